@@ -1,15 +1,35 @@
 from __future__ import absolute_import, division, print_function
-import copy, random
+import random, time
 from game import Game
+import bitboard
+from bitboard import to_board
+from transposition import TranspositionTable
+import heuristic
+from heuristic import evaluate_state
 
 MOVES = {0: 'up', 1: 'left', 2: 'down', 3: 'right'}
 MAX_PLAYER, CHANCE_PLAYER = 0, 1
 
+# returns a hashable encoding of a tile matrix: the packed bitboard for 4x4
+# boards whose tiles fit a nibble and a tuple of rows otherwise
+def board_key(tile_matrix):
+    if len(tile_matrix) == 4:
+        try:
+            return to_board(tile_matrix)
+        except OverflowError:
+            pass
+    return tuple(map(tuple, tile_matrix))
+
 # Tree node. To be used to construct a game tree. 
 class Node: 
+    # set by build_tree on nodes left unexpanded by the probability cutoff
+    pruned = False
+
     # Recommended: do not modify this __init__ function
     def __init__(self, state, player_type):
-        self.state = (copy.deepcopy(state[0]), state[1])
+        # a per-row copy is all a matrix of ints needs (copy.deepcopy is
+        # several times slower)
+        self.state = ([row[:] for row in state[0]], state[1])
 
         # to store a list of (direction, node) tuples
         self.children = []
@@ -25,22 +45,153 @@ class Node:
             return False
 
 
+# Compact tree node for build_compact_tree: the state is an immutable packed
+# bitboard plus score, shared between nodes without copying, and the
+# children are kept in two parallel lists (keys: direction for MAX nodes,
+# cell index 4 * i + j of the placed 2 for CHANCE nodes) that stay empty
+# tuples on leaves.
+class CompactNode:
+    __slots__ = ('board', 'score', 'player_type', 'keys', 'nodes', 'pruned')
+
+    def __init__(self, board, score, player_type):
+        self.board = board
+        self.score = score
+        self.player_type = player_type
+        self.keys = ()
+        self.nodes = ()
+        self.pruned = False
+
+    def add_child(self, key, node):
+        if not self.nodes:
+            self.keys = []
+            self.nodes = []
+        self.keys.append(key)
+        self.nodes.append(node)
+
+    def is_terminal(self):
+        return not self.nodes
+
+    # (tile_matrix, score) view for code written against Node
+    @property
+    def state(self):
+        return (bitboard.to_tile_matrix(self.board), self.score)
+
+
+# score given to the no-op children of a MAX node by build_tree
+NO_MOVE_SCORE = -100
+
+# Node semantics shared by every search (expectimax, custom_expectimax, the
+# batched, stream and compact variants):
+#
+# (direction, value) of a MAX node from its (direction, value) children in
+# MOVES order: the first strictly best move wins, and nothing beats 0, so a
+# node whose children are all worth 0 or less picks direction 0
+def max_entry(children):
+    max_score = 0
+    optimal_direction = 0
+    for direction, score in children:
+        if score > max_score:
+            max_score = score
+            optimal_direction = direction
+    return optimal_direction, max_score
+
+# (None, value) of a CHANCE node from the values of its equally likely
+# children, summed in order
+def chance_entry(values):
+    sum_score = 0
+    count = 0
+    for score in values:
+        sum_score += score
+        count += 1
+    return None, sum_score/count
+
+# depth caps for compute_decision_timed as (minimum open tiles, max depth),
+# since every open tile adds a child to each CHANCE node
+ADAPTIVE_DEPTHS = [(10, 3), (6, 5), (0, 7)]
+MAX_ADAPTIVE_DEPTH = max(depth for _, depth in ADAPTIVE_DEPTHS)
+
+# raised inside the search once the deadline of a timed decision has passed
+class SearchTimeout(Exception):
+    pass
+
 # AI agent. To be used to determine a promising next move.
 class AI:
     # Recommended: do not modify this __init__ function
-    def __init__(self, root_state, search_depth=3): 
+    def __init__(self, root_state, search_depth=3, cache=None, prob_cutoff=0.0, stats=None): 
         self.root = Node(root_state, MAX_PLAYER)
         self.search_depth = search_depth
-        self.simulator = Game(*root_state)
+        # the simulator never undoes, so it keeps no undo history
+        self.simulator = Game(*root_state, undo_depth=0)
+
+        # packed-board engine of the stream searches (bitboard.BoardEngine),
+        # None for board sizes it does not support. Its cells hold every tile
+        # the deepest search can make (one placement per ply is a safe bound),
+        # so small boards near 2^16 get 8-bit cells; the 4x4-only fast paths
+        # (compact tree, parallel, rollouts) fall back unless it is the plain
+        # 4-bit 4x4 engine of the module-level bitboard functions
+        size = self.simulator.board_size
+        self.engine = (bitboard.engine_for(root_state[0], max(search_depth, MAX_ADAPTIVE_DEPTH))
+                       if bitboard.MIN_BOARD_SIZE <= size <= bitboard.MAX_BOARD_SIZE else None)
+
+        # transposition table shared by expectimax and custom_expectimax
+        self.cache = cache if cache is not None else TranspositionTable()
+        # whether stream_expectimax uses the transposition table; without it
+        # the stream search keeps only the current path in memory
+        self.stream_cache = True
+
+        # wall-clock deadline of stream_expectimax (None for no limit) and the
+        # deepest search completed by the last compute_decision_timed call
+        self.deadline = None
+        self.completed_depth = 0
+
+        # CHANCE pruning: nodes whose path probability (the product of the
+        # 1/len(open tiles) chances above them) drops below prob_cutoff are
+        # evaluated as leaves instead of expanded; 0 disables pruning
+        self.prob_cutoff = prob_cutoff
+        self.pruned_nodes = 0
+        # pruned leaves reached so far by the tree evaluations; a subtree
+        # whose evaluation reaches one is not cached (see position_key)
+        self.pruned_leaves = 0
+
+        # root of the tree built by build_compact_tree
+        self.compact_root = None
+
+        # rollouts per root move played by the last compute_decision_rollout
+        self.rollouts_done = 0
+
+        # optional search_stats.SearchStats collector; None disables it
+        self.stats = stats
+
+    # key of a node in the transposition table. The score is part of the
+    # state, and ec separates expectimax from custom_expectimax values.
+    # Terminal nodes are evaluated the same way at any depth, so they share
+    # the key of a leaf at depth 0. The value of a subtree cut by the
+    # probability cutoff depends on the path probability that reached it,
+    # so such values are never stored, and prob_cutoff is part of every key
+    # so that a shared table only serves searches with the same cutoff.
+    def position_key(self, node, depth, ec=False):
+        tile_matrix, score = node.state
+        if node.is_terminal():
+            return (board_key(tile_matrix), score, 0, None, ec, self.prob_cutoff)
+        return (board_key(tile_matrix), score, self.search_depth - depth, node.player_type, ec, self.prob_cutoff)
 
     # recursive function to build a game tree
-    def build_tree(self, node=None, depth=0, ec=False):
+    def build_tree(self, node=None, depth=0, ec=False, prob=1.0):
         if node == None:
             node = self.root
 
+        if depth == 0 and self.stats is not None and not self.stats.timing:
+            return self.stats.timed(self, 'build', lambda: self.build_tree(node, depth, ec, prob))
+
         if depth == self.search_depth: 
             return 
 
+        # probability cutoff: leave unlikely nodes as leaves
+        if prob < self.prob_cutoff:
+            self.pruned_nodes += 1
+            node.pruned = True
+            return
+
         if node.player_type == MAX_PLAYER:
             # TODO: find all children resulting from 
             # all possible moves (ignore "no-op" moves)
@@ -55,6 +206,10 @@ class AI:
             init_game_state = node.state
             init_tile_matrix, init_game_score = init_game_state
 
+            # the simulator may still hold the parent CHANCE state (without
+            # the placed 2), so start every MAX node from its own state
+            self.simulator.reset(init_tile_matrix, init_game_score)
+
             for key, val in MOVES.items():
                 # take the action corresponding to the potential pressed key (up, left, down, right)
                 has_moved = self.simulator.move(key)
@@ -71,13 +226,13 @@ class AI:
                     node.children.append((key, child_node))
 
                     # recursively build the tree starting from child node
-                    self.build_tree(child_node, depth + 1)
+                    self.build_tree(child_node, depth + 1, ec, prob)
 
                     # reset the game to the state as it was before making the potential move
                     self.simulator.reset(init_tile_matrix, init_game_score)
                 else:
                     # create a child node with init game state and no children i.e, leaf node
-                    child_node = Node((init_tile_matrix, -100), CHANCE_PLAYER)
+                    child_node = Node((init_tile_matrix, NO_MOVE_SCORE), CHANCE_PLAYER)
 
                     # add the child node (or leaf/terminal node) as a child of current node
                     node.children.append((key, child_node))
@@ -100,7 +255,7 @@ class AI:
             num_open_tiles = len(open_tiles_lst)
 
             for idx in open_tiles_lst:
-                tm = copy.deepcopy(init_tile_matrix)
+                tm = [row[:] for row in init_tile_matrix]
 
                 tm[idx[0]][idx[1]] = 2
                 modified_game_state = (tm, init_game_score)
@@ -112,62 +267,60 @@ class AI:
                 node.children.append((idx, child_node))
 
                 # recursively build the tree starting from child node
-                self.build_tree(child_node, depth + 1)
+                self.build_tree(child_node, depth + 1, ec, prob / num_open_tiles)
 
                 # reset the game to the state as it was before making the potential move
                 self.simulator.reset(init_tile_matrix, init_game_score)
 
+        if self.stats is not None:
+            record = self.stats.begin(self)
+            record.expanded[node.player_type] += 1
+            record.tree_nodes += len(node.children)
+
         # TODO: build a tree for each child of this node
 
     # expectimax implementation; 
     # returns a (best direction, best value) tuple if node is a MAX_PLAYER
     # and a (None, expected best value) tuple if node is a CHANCE_PLAYER
-    def expectimax(self, node = None):
+    def expectimax(self, node = None, depth = 0):
         # TODO: delete this random choice but make sure the return type of the function is the same
         # return random.randint(0, 3), 0
 
         if node == None:
             node = self.root
 
+        if depth == 0 and self.stats is not None and not self.stats.timing:
+            return self.stats.timed(self, 'eval', lambda: self.expectimax(node, depth))
+
         if node.is_terminal():
             # TODO: base case
+            if self.stats is not None:
+                self.stats.begin(self).leaves += 1
+            if node.pruned:
+                self.pruned_leaves += 1
             return None, node.state[1]
 
-        elif node.player_type == MAX_PLAYER:
-            # TODO: MAX_PLAYER logic
-            # find all the children of the current node
-            child_nodes = node.children
-            num_child_nodes = len(child_nodes)
-
-            max_score = 0
-            optimal_direction = 0
-
-            for i in range(num_child_nodes):
-                _, score = self.expectimax(child_nodes[i][1])
-                direction = child_nodes[i][0]
-
-                if score > max_score:
-                    max_score = score
-                    optimal_direction = direction
-
-            return optimal_direction, max_score
+        key = self.position_key(node, depth)
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            return entry
+        pruned_leaves = self.pruned_leaves
 
+        if node.player_type == MAX_PLAYER:
+            # best child move (see max_entry)
+            entry = max_entry((direction, self.expectimax(child, depth + 1)[1])
+                              for direction, child in node.children)
 
         elif node.player_type == CHANCE_PLAYER:
-            # TODO: CHANCE_PLAYER logic
-            # find all the children of the current node
-            child_nodes = node.children
-            num_child_nodes = len(child_nodes)
-
-            sum_score = 0
-            for i in range(num_child_nodes):
-                _, score = self.expectimax(child_nodes[i][1])
-                sum_score += score
+            # average over the tile placements (see chance_entry)
+            entry = chance_entry(self.expectimax(child, depth + 1)[1] for _, child in node.children)
 
-            return None, sum_score/num_child_nodes
+        if self.pruned_leaves == pruned_leaves:
+            self.cache.store(key, entry)
+        return entry
 
 
-    def custom_expectimax(self, node = None):
+    def custom_expectimax(self, node = None, depth = 0):
         # TODO: delete this random choice but make sure the return type of the function is the same
         # return random.randint(0, 3), 0
 
@@ -175,125 +328,150 @@ class AI:
         if node == None:
             node = self.root
 
+        if depth == 0 and self.stats is not None and not self.stats.timing:
+            return self.stats.timed(self, 'eval', lambda: self.custom_expectimax(node, depth))
+
+        # leaves are cached as well since the custom evaluation is expensive;
+        # their values do not depend on the path, even when pruned
+        if node.pruned:
+            self.pruned_leaves += 1
+        key = self.position_key(node, depth, ec=True)
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            return entry
+        pruned_leaves = self.pruned_leaves
+
         if node.is_terminal():
             # TODO: base case
-            node_tile_matrix, node_game_score = node.state
-
-            # find the highest tile
-            highest_tile = max(max(row) for row in node_tile_matrix)
-
-            # find the total sum of the tile matrix
-            sum_tiles = sum(sum(row) for row in node_tile_matrix)
-
-            # weight matrix
-            # CORNER_WEIGHT_MATRIX = [[6,5,4,3],[5,4,3,2],[4,3,2,1],[3,2,1,0]]
-            CORNER_WEIGHT_MATRIX = [[16,15,14,13],[9,10,11,12],[8,7,6,5],[1,2,3,4]]
-            # CORNER_WEIGHT_MATRIX = [[pow(2,16),pow(2,15),pow(2,14),pow(2,13)],[pow(2,9),pow(2,10),pow(2,11),pow(2,12)],[pow(2,8),pow(2,7),pow(2,6),pow(2,5)],[pow(2,1),pow(2,2),pow(2,3),pow(2,4)]]
-
-            # compute the number of open tiles
-            # open_tiles = []
-            num_open_tiles = 0
-            num_pot_merges = 0
-            num_monotonic_dec = 0
-            num_monotonic_inc = 0
-            corner_score = 0
-            penalty = 0
-
-            for i in range(0, 4):
-                for j in range(0, 4):
-                    if node_tile_matrix[i][j] == 0:
-                        # open_tiles.append((i, j))
-                        num_open_tiles += 1
-
-                    if j > 0:
-                        if node_tile_matrix[i][j-1] == node_tile_matrix[i][j]:
-                            num_pot_merges += 1
-
-                        if node_tile_matrix[i][j-1] > node_tile_matrix[i][j]:
-                            num_monotonic_dec += 1
-                        elif node_tile_matrix[i][j-1] < node_tile_matrix[i][j]:
-                            num_monotonic_inc += 1
-
-                    if i > 0:
-                        if node_tile_matrix[i-1][j] == node_tile_matrix[i][j]:
-                            num_pot_merges += 1
-                        
-                        if node_tile_matrix[i-1][j] > node_tile_matrix[i][j]:
-                            num_monotonic_dec += 1
-                        elif node_tile_matrix[i-1][j] < node_tile_matrix[i][j]:
-                            num_monotonic_inc += 1
-
-                    corner_score += CORNER_WEIGHT_MATRIX[i][j]*node_tile_matrix[i][j]
-
-
-                    if j > 0:
-                        penalty += abs(node_tile_matrix[i][j] - node_tile_matrix[i][j-1])
-                    if i > 0:
-                        penalty += abs(node_tile_matrix[i][j] - node_tile_matrix[i-1][j])
-                    if i < 3:
-                        penalty += abs(node_tile_matrix[i][j] - node_tile_matrix[i+1][j])
-                    if j < 3:
-                        penalty += abs(node_tile_matrix[i][j] - node_tile_matrix[i][j+1])
-
-            # heuristics
-            GAME_SCORE_WEIGHT = 2
-            SUM_TILE_WEIGHT = 0
-            OPEN_TILE_WEIGHT = 800
-            POT_MERGE_WEIGHT = 500
-            MAX_TILE_WEIGHT = 10
-            MONOTONIC_SCORE = 0
-            CORNER_WEIGHT = 0
-            PENALTY_WEIGHT = 0
-
-            custom_score = (GAME_SCORE_WEIGHT*node_game_score + 
-                            SUM_TILE_WEIGHT*sum_tiles +
-                            MAX_TILE_WEIGHT*highest_tile + 
-                            OPEN_TILE_WEIGHT*num_open_tiles + 
-                            POT_MERGE_WEIGHT*num_pot_merges -
-                            MONOTONIC_SCORE*min(num_monotonic_inc, num_monotonic_dec) +
-                            CORNER_WEIGHT*corner_score -
-                            PENALTY_WEIGHT*penalty
-                            )
-            
-            # print(SUM_TILE_WEIGHT*sum_tiles, OPEN_TILE_WEIGHT*num_open_tiles, POT_MERGE_WEIGHT*num_pot_merges, CORNER_WEIGHT*corner_score)
-            # custom_score = 0.2*highest_tile + 0.4*num_open_tiles*1000 + 0.4*num_pot_merges*1000
-            # assert(custom_score > 0)
-            return None, custom_score
+            entry = (None, evaluate_state(*node.state))
+            if self.stats is not None:
+                self.stats.begin(self).leaves += 1
 
         elif node.player_type == MAX_PLAYER:
-            # print("Inside custom MAX")
-            # TODO: MAX_PLAYER logic
-            # find all the children of the current node
-            child_nodes = node.children
-            num_child_nodes = len(child_nodes)
-
-            max_score = 0
-            optimal_direction = 0
+            entry = max_entry((direction, self.custom_expectimax(child, depth + 1)[1])
+                              for direction, child in node.children)
 
-            for i in range(num_child_nodes):
-                _, score = self.custom_expectimax(child_nodes[i][1])
-                direction = child_nodes[i][0]
-
-                if score > max_score:
-                    max_score = score
-                    optimal_direction = direction
+        elif node.player_type == CHANCE_PLAYER:
+            entry = chance_entry(self.custom_expectimax(child, depth + 1)[1] for _, child in node.children)
 
-            return optimal_direction, max_score
+        if self.pruned_leaves == pruned_leaves:
+            self.cache.store(key, entry)
+        return entry
 
 
-        elif node.player_type == CHANCE_PLAYER:
-            # TODO: CHANCE_PLAYER logic
-            # find all the children of the current node
-            child_nodes = node.children
-            num_child_nodes = len(child_nodes)
+    # custom_expectimax over a tree built by build_tree, with all distinct
+    # leaf states of the subtree gathered first and scored in one batch by
+    # batch_eval (NumPy); the scores are then passed up through the same
+    # CHANCE averages and MAX selections as custom_expectimax
+    def custom_expectimax_batched(self, node = None):
+        from batch_eval import evaluate_states
 
-            sum_score = 0
-            for i in range(num_child_nodes):
-                _, score = self.custom_expectimax(child_nodes[i][1])
-                sum_score += score
+        if node == None:
+            node = self.root
 
-            return None, sum_score/num_child_nodes
+        leaf_keys = {}
+        leaf_states = []
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.is_terminal():
+                key = (board_key(current.state[0]), current.state[1])
+                if key not in leaf_keys:
+                    leaf_keys[key] = len(leaf_states)
+                    leaf_states.append(current.state)
+            else:
+                stack.extend(child for _, child in current.children)
+        leaf_values = evaluate_states(leaf_states)
+
+        def value_of(current):
+            if current.is_terminal():
+                return None, leaf_values[leaf_keys[(board_key(current.state[0]), current.state[1])]]
+            if current.player_type == MAX_PLAYER:
+                return max_entry((direction, value_of(child)[1]) for direction, child in current.children)
+            return chance_entry(value_of(child)[1] for _, child in current.children)
+
+        return value_of(node)
+
+    # value of a leaf of the search: the game score for expectimax and the
+    # custom evaluation function for custom_expectimax
+    def leaf_value(self, board, score, ec=False):
+        if ec:
+            return self.engine.evaluate(board, score)
+        return score
+
+    # depth-first expectimax on a board packed by self.engine (any size from
+    # bitboard.MIN_BOARD_SIZE to MAX_BOARD_SIZE) that evaluates children
+    # as it generates them instead of building a tree of Nodes. The search
+    # itself only holds the current path; with stream_cache set (the
+    # default) every node is also stored in the transposition table, whose
+    # capacity then bounds the memory used, while with stream_cache unset
+    # memory is O(depth). Mirrors build_tree followed by expectimax (or
+    # custom_expectimax if ec is set), including the no-op children of MAX
+    # nodes, and returns the same (direction, value) tuples.
+    def stream_expectimax(self, board=None, score=None, player_type=MAX_PLAYER, depth=0, ec=False, prob=1.0):
+        engine = self.engine
+        if board is None:
+            board = engine.to_board(self.root.state[0])
+            score = self.root.state[1]
+
+        if self.stats is not None:
+            if depth == 0 and not self.stats.timing:
+                return self.stats.timed(self, 'eval',
+                                        lambda: self.stream_expectimax(board, score, player_type, depth, ec, prob))
+            # nodes on the current path (the cache is not counted)
+            record = self.stats.begin(self)
+            if depth + 1 > record.peak_nodes:
+                record.peak_nodes = depth + 1
+
+        if depth == self.search_depth or prob < self.prob_cutoff:
+            if depth < self.search_depth:
+                self.pruned_nodes += 1
+            if self.stats is not None:
+                self.stats.current.leaves += 1
+            return None, self.leaf_value(board, score, ec)
+
+        if self.stream_cache:
+            key = (board, score, self.search_depth - depth, player_type, ec, self.prob_cutoff)
+            entry = self.cache.lookup(key)
+            if entry is not None:
+                return entry
+        pruned_nodes = self.pruned_nodes
+
+        if self.deadline is not None and time.time() > self.deadline:
+            raise SearchTimeout()
+
+        if player_type == MAX_PLAYER:
+            if self.stats is not None:
+                self.stats.current.expanded[MAX_PLAYER] += 1
+            children = []
+            for direction in MOVES:
+                new_board, gain = engine.move(board, direction)
+                if new_board != board:
+                    _, value = self.stream_expectimax(new_board, score + gain, CHANCE_PLAYER, depth + 1, ec, prob)
+                else:
+                    value = self.leaf_value(board, NO_MOVE_SCORE, ec)
+                    if self.stats is not None:
+                        self.stats.current.leaves += 1
+                children.append((direction, value))
+            entry = max_entry(children)
 
+        else:
+            open_tiles = engine.get_open_tiles(board)
+            if not open_tiles:
+                entry = (None, self.leaf_value(board, score, ec))
+                if self.stats is not None:
+                    self.stats.current.leaves += 1
+            else:
+                if self.stats is not None:
+                    self.stats.current.expanded[CHANCE_PLAYER] += 1
+                entry = chance_entry(self.stream_expectimax(engine.place_tile(board, tile), score, MAX_PLAYER,
+                                                            depth + 1, ec, prob / len(open_tiles))[1]
+                                     for tile in open_tiles)
+
+        # values of subtrees cut by the probability cutoff are not cached
+        if self.stream_cache and self.pruned_nodes == pruned_nodes:
+            self.cache.store(key, entry)
+        return entry
 
     # Do not modify this function
     def compute_decision(self):
@@ -311,3 +489,246 @@ class AI:
         # Modified Expectimax Algorithm that returns the direction
         direction, _ = self.custom_expectimax(self.root)
         return direction
+
+    # expectimax decision without building a tree (see stream_expectimax);
+    # cache=False searches in O(depth) memory without the transposition
+    # table. Board sizes without an engine fall back to the tree-based search
+    def compute_decision_stream(self, ec=False, cache=True):
+        if self.engine is None:
+            return self.compute_decision_ec() if ec else self.compute_decision()
+        self.stream_cache = cache
+        direction, _ = self.stream_expectimax(ec=ec)
+        return direction
+
+    # maximum depth worth searching from a board with the given number of
+    # open tiles (see ADAPTIVE_DEPTHS)
+    @staticmethod
+    def adaptive_depth(num_open_tiles):
+        for min_open_tiles, max_depth in ADAPTIVE_DEPTHS:
+            if num_open_tiles >= min_open_tiles:
+                return max_depth
+        return ADAPTIVE_DEPTHS[-1][1]
+
+    # anytime decision: searches depth 1, 2, 3... until budget_ms runs out
+    # (or the adaptive depth cap is reached) and returns the best move of the
+    # deepest search that finished. Root moves are searched best-first using
+    # the previous iteration's values, and the transposition table carries
+    # values over between iterations.
+    def compute_decision_timed(self, budget_ms, ec=True, max_depth=None):
+        if self.engine is None:
+            return self.compute_decision_ec() if ec else self.compute_decision()
+        if self.stats is not None and not self.stats.timing:
+            return self.stats.timed(self, 'eval', lambda: self.compute_decision_timed(budget_ms, ec, max_depth))
+
+        board = self.engine.to_board(self.root.state[0])
+        score = self.root.state[1]
+        if max_depth is None:
+            max_depth = self.adaptive_depth(len(self.engine.get_open_tiles(board)))
+        deadline = time.time() + budget_ms / 1000.0
+
+        search_depth = self.search_depth
+        order = list(MOVES)
+        best_direction = 0
+        self.completed_depth = 0
+        try:
+            for depth in range(1, max_depth + 1):
+                self.search_depth = depth
+                # the first iteration always completes so there is a move to return
+                self.deadline = deadline if depth > 1 else None
+                values = {}
+                try:
+                    for direction in order:
+                        values[direction] = self.root_move_value(board, score, direction, ec)
+                except SearchTimeout:
+                    # the previous best move is searched first; once it is done,
+                    # any finished move that beats it is a safe improvement
+                    if order[0] in values:
+                        best_direction = self.best_root_move(values)
+                    break
+                best_direction = self.best_root_move(values)
+                self.completed_depth = depth
+                order = sorted(order, key=lambda d: -values[d])
+                if time.time() > deadline:
+                    break
+        finally:
+            self.search_depth = search_depth
+            self.deadline = None
+            if self.stats is not None:
+                self.stats.current.search_depth = self.completed_depth
+        return best_direction
+
+    # value of playing direction at the root, as seen by the root MAX node
+    def root_move_value(self, board, score, direction, ec=False):
+        new_board, gain = self.engine.move(board, direction)
+        if new_board == board:
+            return self.leaf_value(board, NO_MOVE_SCORE, ec)
+        _, value = self.stream_expectimax(new_board, score + gain, CHANCE_PLAYER, 1, ec)
+        return value
+
+    # picks the root move from {direction: value} with the same tie-breaking
+    # as the MAX branch of expectimax
+    @staticmethod
+    def best_root_move(values):
+        direction, _ = max_entry((direction, values[direction]) for direction in MOVES if direction in values)
+        return direction
+
+    # expectimax decision with the root moves (and, with split_chance, the
+    # tile placements of each root CHANCE node) scored in parallel on the
+    # process pool of parallel_search. Returns the same direction as
+    # compute_decision_stream.
+    def compute_decision_parallel(self, ec=False, split_chance=False, max_workers=None):
+        if self.engine is not bitboard.get_engine():
+            return self.compute_decision_ec() if ec else self.compute_decision()
+        import parallel_search
+
+        board = to_board(self.root.state[0])
+        score = self.root.state[1]
+        pool = parallel_search.get_pool(max_workers)
+        weights = heuristic.current_weights()
+
+        values = {}
+        pending = {}
+        for direction in MOVES:
+            new_board, gain = bitboard.move(board, direction)
+            if new_board == board:
+                values[direction] = self.leaf_value(board, NO_MOVE_SCORE, ec)
+            elif self.search_depth <= 1:
+                values[direction] = self.leaf_value(new_board, score + gain, ec)
+            elif split_chance:
+                open_tiles = bitboard.get_open_tiles(new_board)
+                pending[direction] = [
+                    pool.submit(parallel_search.score_subtree,
+                                (bitboard.place_tile(new_board, tile), score + gain, MAX_PLAYER, 2,
+                                 self.search_depth, ec, 1.0 / len(open_tiles), self.prob_cutoff, weights))
+                    for tile in open_tiles]
+            else:
+                pending[direction] = [
+                    pool.submit(parallel_search.score_subtree,
+                                (new_board, score + gain, CHANCE_PLAYER, 1,
+                                 self.search_depth, ec, 1.0, self.prob_cutoff, weights))]
+
+        for direction, futures in pending.items():
+            results = [future.result() for future in futures]
+            self.pruned_nodes += sum(pruned_nodes for _, pruned_nodes in results)
+            _, values[direction] = chance_entry(value for value, _ in results)
+        return self.best_root_move(values)
+
+    # Monte Carlo decision: every legal root move is scored by the mean final
+    # score of `rollouts` batched games (see batch_game.rollout_scores) that
+    # start from it and play `horizon` more moves with the given policy. With
+    # budget_ms, rounds of `rollouts` games per move are repeated until the
+    # wall-clock budget is spent (at least one round is always played).
+    def compute_decision_rollout(self, rollouts=100, horizon=20, policy='random', budget_ms=None, seed=None):
+        if self.engine is not bitboard.get_engine() or bitboard.may_overflow_nibbles(self.root.state[0], horizon):
+            return self.compute_decision_ec()
+        if self.stats is not None and not self.stats.timing:
+            return self.stats.timed(self, 'eval', lambda: self.compute_decision_rollout(
+                rollouts, horizon, policy, budget_ms, seed))
+        import numpy as np
+        from batch_game import rollout_scores
+
+        board = to_board(self.root.state[0])
+        score = self.root.state[1]
+        starts = {}
+        for direction in MOVES:
+            new_board, gain = bitboard.move(board, direction)
+            if new_board != board:
+                starts[direction] = (new_board, score + gain)
+        if not starts:
+            return 0
+
+        # seeded from the random module by default, so that random.seed
+        # makes whole games reproducible
+        rng = np.random.default_rng(seed if seed is not None else random.getrandbits(62))
+        deadline = time.time() + budget_ms / 1000.0 if budget_ms is not None else None
+        directions = list(starts)
+        totals = np.zeros(len(directions))
+        self.rollouts_done = 0
+        while True:
+            boards = np.repeat(np.array([starts[d][0] for d in directions], dtype=np.uint64), rollouts)
+            scores = np.repeat(np.array([starts[d][1] for d in directions], dtype=np.int64), rollouts)
+            final = rollout_scores(boards, scores, horizon, policy, rng, int(rng.integers(1 << 62)), spawn=True)
+            totals += final.reshape(len(directions), rollouts).sum(axis=1)
+            self.rollouts_done += rollouts
+            if self.stats is not None:
+                self.stats.current.leaves += len(boards)
+            if deadline is None or time.time() > deadline:
+                break
+
+        # first legal move in MOVES order wins ties, as in expectimax
+        return directions[int(np.argmax(totals))]
+
+    # compute_decision_ec with the leaves scored in one NumPy batch
+    def compute_decision_ec_batched(self):
+        self.build_tree()
+        direction, _ = self.custom_expectimax_batched(self.root)
+        return direction
+
+    # build_tree on CompactNodes: same tree shape, including the no-op
+    # children and probability pruning, but every node stores a packed
+    # bitboard instead of a copied tile matrix
+    def build_compact_tree(self, node=None, depth=0, prob=1.0):
+        if node is None:
+            if self.compact_root is None:
+                self.compact_root = CompactNode(to_board(self.root.state[0]), self.root.state[1], MAX_PLAYER)
+            node = self.compact_root
+
+        if depth == self.search_depth:
+            return
+
+        if prob < self.prob_cutoff:
+            self.pruned_nodes += 1
+            node.pruned = True
+            return
+
+        board = node.board
+        if node.player_type == MAX_PLAYER:
+            for direction in MOVES:
+                new_board, gain = bitboard.move(board, direction)
+                if new_board != board:
+                    child_node = CompactNode(new_board, node.score + gain, CHANCE_PLAYER)
+                    node.add_child(direction, child_node)
+                    self.build_compact_tree(child_node, depth + 1, prob)
+                else:
+                    node.add_child(direction, CompactNode(board, NO_MOVE_SCORE, CHANCE_PLAYER))
+        else:
+            open_tiles = bitboard.get_open_tiles(board)
+            for i, j in open_tiles:
+                child_node = CompactNode(bitboard.place_tile(board, (i, j)), node.score, MAX_PLAYER)
+                node.add_child(4 * i + j, child_node)
+                self.build_compact_tree(child_node, depth + 1, prob / len(open_tiles))
+
+    # expectimax (or custom_expectimax if ec is set) over a compact tree
+    def compact_expectimax(self, node=None, depth=0, ec=False):
+        if node is None:
+            node = self.compact_root
+
+        if node.is_terminal():
+            if node.pruned:
+                self.pruned_leaves += 1
+            return None, self.leaf_value(node.board, node.score, ec)
+
+        key = (node.board, node.score, self.search_depth - depth, node.player_type, ec, self.prob_cutoff)
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            return entry
+        pruned_leaves = self.pruned_leaves
+
+        if node.player_type == MAX_PLAYER:
+            entry = max_entry((direction, self.compact_expectimax(child_node, depth + 1, ec)[1])
+                              for direction, child_node in zip(node.keys, node.nodes))
+        else:
+            entry = chance_entry(self.compact_expectimax(child_node, depth + 1, ec)[1] for child_node in node.nodes)
+
+        if self.pruned_leaves == pruned_leaves:
+            self.cache.store(key, entry)
+        return entry
+
+    # compute_decision / compute_decision_ec on a compact tree
+    def compute_decision_compact(self, ec=False):
+        if self.engine is not bitboard.get_engine():
+            return self.compute_decision_ec() if ec else self.compute_decision()
+        self.compact_root = None
+        self.build_compact_tree()
+        direction, _ = self.compact_expectimax(self.compact_root, 0, ec)
+        return direction
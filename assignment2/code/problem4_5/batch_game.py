@@ -0,0 +1,272 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+
+from move_tables import load_or_build_tables, LEFT, RIGHT, UP, DOWN, OVERFLOW_GAIN
+
+# Vectorized 4x4 game engine: M games are held as an (M,) uint64 array of
+# packed bitboards (same layout as bitboard.py) plus an (M,) int64 array of
+# scores, and every call advances all of them at once with NumPy table
+# lookups. Directions follow Game.move (see bitboard.py). Like bitboard.move,
+# moves raise OverflowError when two 32768 tiles would merge.
+#
+# Random tiles come from per-board counter-based streams: the n-th tile of
+# board i is drawn from splitmix64(key[i] + n * GOLDEN_GAMMA), so each board's
+# spawns depend only on its own key and history, not on the other boards in
+# the batch or on the order of calls.
+#
+#     games = BatchGame(10000, seed=1)
+#     while not games.game_over_mask().all():
+#         games.move_and_place(np.random.randint(0, 4, size=10000))
+
+BOARD_SIZE = 4
+NUM_CELLS = BOARD_SIZE * BOARD_SIZE
+
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+_U4 = np.uint64(4)
+_U16 = np.uint64(16)
+_ROW_MASK = np.uint64(0xFFFF)
+_CELL_SHIFTS = np.arange(0, 4 * NUM_CELLS, 4, dtype=np.uint64)
+
+_tables = None
+
+
+def _load_tables():
+    global _tables
+    deltas, gains = load_or_build_tables()
+    _tables = (
+        [np.frombuffer(table, dtype=np.uint64) for table in deltas],
+        [np.frombuffer(table, dtype=np.uint32).astype(np.int64) for table in gains],
+    )
+    return _tables
+
+
+# splitmix64 finalizer, applied elementwise with wrapping uint64 arithmetic
+def splitmix64(x):
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        z = x + GOLDEN_GAMMA
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+# key of the random stream of each board i in range(num_boards)
+def stream_keys(num_boards, seed=0):
+    with np.errstate(over='ignore'):
+        base = splitmix64(np.uint64(seed & 0xFFFFFFFFFFFFFFFF))
+        return splitmix64(base + np.arange(num_boards, dtype=np.uint64) * GOLDEN_GAMMA)
+
+
+def transpose_boards(boards):
+    a1 = boards & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = boards & np.uint64(0x0000F0F00000F0F0)
+    a3 = boards & np.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = a & np.uint64(0xFF00FF0000FF00FF)
+    b2 = a & np.uint64(0x00FF00FF00000000)
+    b3 = a & np.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+
+# moves every board in the same direction; returns (new boards, gains)
+def move_all(boards, direction):
+    deltas, gains = _tables or _load_tables()
+    boards = np.asarray(boards, dtype=np.uint64)
+    if direction == 0 or direction == 2:
+        table = LEFT if direction == 0 else RIGHT
+        lines = boards
+        spacing = _U16
+    elif direction == 1 or direction == 3:
+        table = UP if direction == 1 else DOWN
+        lines = transpose_boards(boards)
+        spacing = _U4
+    else:
+        raise ValueError("invalid direction: {}".format(direction))
+
+    delta = np.zeros_like(boards)
+    gain = np.zeros(boards.shape, dtype=np.int64)
+    for k in range(BOARD_SIZE):
+        rows = ((lines >> (_U16 * np.uint64(k))) & _ROW_MASK).astype(np.intp)
+        delta |= deltas[table][rows] << (spacing * np.uint64(k))
+        gain += gains[table][rows]
+    if (gain >= OVERFLOW_GAIN).any():
+        raise OverflowError("merging two 32768 tiles overflows a 4-bit cell")
+    return boards ^ delta, gain
+
+
+# moves board i in directions[i]; returns (new boards, gains)
+def move_boards(boards, directions):
+    boards = np.asarray(boards, dtype=np.uint64)
+    directions = np.broadcast_to(np.asarray(directions), boards.shape)
+    if ((directions < 0) | (directions > 3)).any():
+        raise ValueError("invalid direction in {}".format(np.unique(directions)))
+    new_boards = boards.copy()
+    gains = np.zeros(boards.shape, dtype=np.int64)
+    for direction in range(4):
+        mask = directions == direction
+        if mask.any():
+            new_boards[mask], gains[mask] = move_all(boards[mask], direction)
+    return new_boards, gains
+
+
+# (M, 16) array of the log2 tile values, cell (i, j) at column 4 * i + j
+def board_ranks(boards):
+    boards = np.asarray(boards, dtype=np.uint64)
+    return ((boards[:, None] >> _CELL_SHIFTS) & np.uint64(0xF)).astype(np.int64)
+
+
+# (M, 16) mask of the open cells
+def open_cells(boards):
+    return board_ranks(boards) == 0
+
+
+# (M, 4) mask of the directions that change each board
+def can_move_boards(boards):
+    boards = np.asarray(boards, dtype=np.uint64)
+    return np.stack([move_all(boards, direction)[0] != boards for direction in range(4)], axis=1)
+
+
+# places a 2 on a random open cell of every board that has one, the n-th
+# draw of board i coming from splitmix64(keys[i] + counters[i] * GOLDEN_GAMMA);
+# returns (new boards, new counters). Full boards are left unchanged and do
+# not advance their counter.
+def place_random_tiles(boards, keys, counters):
+    boards = np.asarray(boards, dtype=np.uint64)
+    open_mask = open_cells(boards)
+    num_open = open_mask.sum(axis=1)
+    has_open = num_open > 0
+
+    with np.errstate(over='ignore'):
+        draws = splitmix64(keys + counters * GOLDEN_GAMMA)
+    # the top 32 bits scaled to [0, num_open) pick the k-th open cell in
+    # row-major order
+    k = ((draws >> np.uint64(32)) * num_open.astype(np.uint64)) >> np.uint64(32)
+    rank_of_cell = np.cumsum(open_mask, axis=1) - 1
+    cell = np.argmax(open_mask & (rank_of_cell == k.astype(np.int64)[:, None]), axis=1)
+
+    placed = np.uint64(1) << (_U4 * cell.astype(np.uint64))
+    new_boards = np.where(has_open, boards | placed, boards)
+    return new_boards, counters + has_open.astype(np.uint64)
+
+
+class BatchGame:
+    # num_games fresh games with two random tiles each, or the given boards
+    # (packed bitboards) and scores; seed selects the random streams
+    def __init__(self, num_games=None, boards=None, scores=None, seed=0):
+        if boards is None:
+            if num_games is None:
+                raise ValueError("either num_games or boards is required")
+            boards = np.zeros(num_games, dtype=np.uint64)
+            fresh = True
+        else:
+            boards = np.array(boards, dtype=np.uint64).reshape(-1)
+            fresh = False
+        self.boards = boards
+        self.scores = (np.zeros(len(boards), dtype=np.int64) if scores is None
+                       else np.array(scores, dtype=np.int64).reshape(-1))
+        if len(self.scores) != len(self.boards):
+            raise ValueError("got {} scores for {} boards".format(len(self.scores), len(self.boards)))
+        self.keys = stream_keys(len(boards), seed)
+        self.counters = np.zeros(len(boards), dtype=np.uint64)
+        if fresh:
+            self.place_random_tiles()
+            self.place_random_tiles()
+
+    # batch of the given (tile_matrix, score) states
+    @classmethod
+    def from_states(cls, states, seed=0):
+        from bitboard import to_board
+        for tile_matrix, _ in states:
+            if len(tile_matrix) != BOARD_SIZE:
+                raise ValueError("BatchGame only supports {0}x{0} boards".format(BOARD_SIZE))
+        return cls(boards=[to_board(tile_matrix) for tile_matrix, _ in states],
+                   scores=[score for _, score in states], seed=seed)
+
+    def __len__(self):
+        return len(self.boards)
+
+    # applies directions (one per board, or a single direction for all) and
+    # returns the mask of boards that changed
+    def move(self, directions):
+        new_boards, gains = move_boards(self.boards, directions)
+        moved = new_boards != self.boards
+        self.boards = new_boards
+        self.scores += gains
+        return moved
+
+    # places a random tile on the boards selected by mask (all by default)
+    def place_random_tiles(self, mask=None):
+        if mask is None:
+            self.boards, self.counters = place_random_tiles(self.boards, self.keys, self.counters)
+        else:
+            self.boards[mask], self.counters[mask] = place_random_tiles(
+                self.boards[mask], self.keys[mask], self.counters[mask])
+
+    # like Game.move_and_place: a tile only spawns on boards that moved
+    def move_and_place(self, directions):
+        moved = self.move(directions)
+        self.place_random_tiles(moved)
+        return moved
+
+    # (M, 4) mask of legal directions
+    def can_move_mask(self):
+        return can_move_boards(self.boards)
+
+    def game_over_mask(self):
+        return ~self.can_move_mask().any(axis=1)
+
+    def open_counts(self):
+        return open_cells(self.boards).sum(axis=1)
+
+    # (M, 4, 4) array of tile values
+    def tile_matrices(self):
+        ranks = board_ranks(self.boards).reshape(-1, BOARD_SIZE, BOARD_SIZE)
+        return np.where(ranks > 0, np.left_shift(1, ranks), 0)
+
+    def get_state(self, i):
+        from bitboard import to_tile_matrix
+        return (to_tile_matrix(int(self.boards[i])), int(self.scores[i]))
+
+
+ROLLOUT_POLICIES = ('random', 'greedy')
+
+# plays every board for up to horizon moves with the given policy and
+# returns the final scores. 'random' picks uniformly among the legal moves,
+# 'greedy' picks the legal move with the largest immediate gain (ties broken
+# at random). Boards that reach game over keep their score. With spawn set, a
+# random tile is placed on every board first (for boards that were just
+# moved). rng drives the policy; seed selects the tile streams.
+def rollout_scores(boards, scores, horizon, policy='random', rng=None, seed=0, spawn=False):
+    if policy not in ROLLOUT_POLICIES:
+        raise ValueError("unknown rollout policy '{}' (choose from {})".format(
+            policy, ', '.join(ROLLOUT_POLICIES)))
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    games = BatchGame(boards=boards, scores=scores, seed=seed)
+    if spawn:
+        games.place_random_tiles()
+    active = np.ones(len(games), dtype=bool)
+    for _ in range(horizon):
+        boards = games.boards[active]
+        if not len(boards):
+            break
+        moved = np.empty((len(boards), 4), dtype=bool)
+        preference = rng.random((len(boards), 4))
+        for direction in range(4):
+            new_boards, gains = move_all(boards, direction)
+            moved[:, direction] = new_boards != boards
+            if policy == 'greedy':
+                preference[:, direction] += gains
+        legal = moved.any(axis=1)
+        directions = np.argmax(np.where(moved, preference, -1.0), axis=1)
+
+        index = np.flatnonzero(active)
+        active[index[~legal]] = False
+        step = np.zeros(len(games), dtype=bool)
+        step[index[legal]] = True
+        new_boards, gains = move_boards(games.boards[step], directions[legal])
+        games.boards[step] = new_boards
+        games.scores[step] += gains
+        games.place_random_tiles(step)
+    return games.scores
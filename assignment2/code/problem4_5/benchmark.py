@@ -0,0 +1,223 @@
+from __future__ import absolute_import, division, print_function
+import argparse, json, platform, random, sys, time, timeit
+
+from game import Game
+from ai import AI
+import bitboard
+from heuristic import custom_evaluation, evaluate_board
+
+# Throughput benchmarks of the 2048 engine and search, run on the boards of
+# test_states plus seeded mid-game and late-game boards. Every benchmark
+# reports operations per second; results go to a JSON file and can be
+# compared with a baseline file written by an earlier run:
+#
+#     python benchmark.py --output baseline.json
+#     ... change the engine ...
+#     python benchmark.py --output new.json --baseline baseline.json
+#
+# Every benchmark is timed in --repeat rounds of about --min-time seconds
+# and reports its best round, which is the least disturbed by other load on
+# the machine; the median and the spread of the rounds go to the JSON file
+# too. The run exits with status 1 if the best round of any benchmark is
+# slower than the baseline by more than --threshold (a fraction, 0.1 = 10%).
+# Benchmarks whose rounds spread by more than --threshold in either run are
+# reported with a warning: the machine was too noisy for the gate to be
+# trusted there, so rerun them with more --repeat or --min-time.
+
+DEFAULT_DEPTHS = [2, 3, 4]
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_MIN_TIME = 0.2
+DEFAULT_REPEAT = 5
+
+def load_test_states(filename='test_states'):
+    game = Game(undo_depth=0)
+    states = []
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                game.load_state_line(line.strip())
+                states.append(([row[:] for row in game.tile_matrix], game.score))
+    return states
+
+# plays seeded games with random moves and keeps the states half way
+# through and a few moves before the end of every game
+def generate_states(num_games=10, seed=0):
+    mid_game = []
+    late_game = []
+    state = random.getstate()
+    for k in range(num_games):
+        random.seed(seed + k)
+        chooser = random.Random(seed + k)
+        game = Game(undo_depth=0)
+        history = []
+        while not game.game_over():
+            history.append(([row[:] for row in game.tile_matrix], game.score))
+            game.move_and_place(chooser.randint(0, 3))
+        mid_game.append(history[len(history) // 2])
+        late_game.append(history[max(0, len(history) - 5)])
+    random.setstate(state)
+    return mid_game, late_game
+
+# times `repeat` rounds of calls to run(), each round lasting about
+# min_time seconds, with timeit (so the garbage collector is off while
+# timing); given that every call performs ops operations, returns a dict with
+# the operations per second of the best round, the median round and the
+# spread (max - min) / max of the rounds
+def measure(run, ops, min_time, repeat=DEFAULT_REPEAT):
+    timer = timeit.Timer(run)
+    number, elapsed = timer.autorange()
+    number = max(1, int(round(number * min_time / elapsed)))
+    rates = sorted(number * ops / t for t in timer.repeat(repeat, number))
+    return {
+        'best': rates[-1],
+        'median': rates[len(rates) // 2],
+        'spread': (rates[-1] - rates[0]) / rates[-1],
+        'repeat': repeat,
+        'calls': number,
+    }
+
+def bench_game_moves(states, min_time, repeat=DEFAULT_REPEAT):
+    game = Game(undo_depth=0)
+    def run():
+        for tile_matrix, score in states:
+            for direction in range(4):
+                # reset copies the rows, so this includes one copy per move
+                game.reset(tile_matrix, score)
+                game.move(direction)
+    return measure(run, 4 * len(states), min_time, repeat)
+
+def bench_bitboard_moves(states, min_time, repeat=DEFAULT_REPEAT):
+    boards = [bitboard.to_board(tile_matrix) for tile_matrix, _ in states]
+    def run():
+        for board in boards:
+            for direction in range(4):
+                bitboard.move(board, direction)
+    return measure(run, 4 * len(boards), min_time, repeat)
+
+def bench_custom_evaluation(states, min_time, repeat=DEFAULT_REPEAT):
+    def run():
+        for tile_matrix, score in states:
+            custom_evaluation(tile_matrix, score)
+    return measure(run, len(states), min_time, repeat)
+
+def bench_evaluate_board(states, min_time, repeat=DEFAULT_REPEAT):
+    boards = [(bitboard.to_board(tile_matrix), score) for tile_matrix, score in states]
+    evaluate_board(0, 0)
+    def run():
+        for board, score in boards:
+            evaluate_board(board, score)
+    return measure(run, len(boards), min_time, repeat)
+
+def bench_decisions(states, method, depth, min_time, repeat=DEFAULT_REPEAT):
+    def run():
+        for state in states:
+            getattr(AI(state, depth), method)()
+    return measure(run, len(states), min_time, repeat)
+
+# returns {name: measure() result} of every benchmark
+def run_benchmarks(depths=DEFAULT_DEPTHS, min_time=DEFAULT_MIN_TIME, num_games=10, seed=0, log=None,
+                   repeat=DEFAULT_REPEAT):
+    test_states = load_test_states()
+    mid_game, late_game = generate_states(num_games, seed)
+    all_states = test_states + mid_game + late_game
+
+    benchmarks = [
+        ('game_move.moves_per_sec', lambda: bench_game_moves(all_states, min_time, repeat)),
+        ('bitboard_move.moves_per_sec', lambda: bench_bitboard_moves(all_states, min_time, repeat)),
+        ('custom_evaluation.leaves_per_sec', lambda: bench_custom_evaluation(all_states, min_time, repeat)),
+        ('evaluate_board.leaves_per_sec', lambda: bench_evaluate_board(all_states, min_time, repeat)),
+    ]
+    for depth in depths:
+        for method in ('compute_decision', 'compute_decision_ec'):
+            for name, states in (('test', test_states), ('mid', mid_game), ('late', late_game)):
+                benchmarks.append(('{}.depth{}.{}.decisions_per_sec'.format(method, depth, name),
+                                   lambda method=method, depth=depth, states=states:
+                                   bench_decisions(states, method, depth, min_time, repeat)))
+
+    results = {}
+    for name, bench in benchmarks:
+        results[name] = bench()
+        if log is not None:
+            print("{:<55} {:>14.1f}  spread {:5.1%}".format(name, results[name]['best'], results[name]['spread']),
+                  file=log)
+    return results
+
+# (best rate, spread) of a measure() result; a plain number is taken as a
+# best rate without spread
+def best_and_spread(entry):
+    if isinstance(entry, dict):
+        return entry['best'], entry.get('spread', 0.0)
+    return entry, 0.0
+
+# returns [(name, baseline, current, relative change)] of the benchmarks
+# whose best rate is slower than the baseline by more than threshold.
+# results and baseline map names to measure() results.
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    regressions = []
+    for name, entry in sorted(baseline.items()):
+        if name not in results:
+            continue
+        old, _ = best_and_spread(entry)
+        new, _ = best_and_spread(results[name])
+        if old <= 0:
+            continue
+        change = new / old - 1
+        if change < -threshold:
+            regressions.append((name, old, new, change))
+    return regressions
+
+# returns [(name, baseline spread, current spread)] of the benchmarks of
+# both runs whose rounds spread by more than threshold in either run
+def find_noisy(results, baseline, threshold=DEFAULT_THRESHOLD):
+    noisy = []
+    for name, entry in sorted(baseline.items()):
+        if name not in results:
+            continue
+        _, old_spread = best_and_spread(entry)
+        _, new_spread = best_and_spread(results[name])
+        if max(old_spread, new_spread) > threshold:
+            noisy.append((name, old_spread, new_spread))
+    return noisy
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='2048 engine and search throughput benchmarks.')
+    parser.add_argument('--depths', type=int, nargs='+', default=DEFAULT_DEPTHS, help='search depths of the decision benchmarks')
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME, help='seconds of each timing round')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timing rounds of each benchmark')
+    parser.add_argument('--games', type=int, default=10, help='generated games for mid- and late-game boards')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated games')
+    parser.add_argument('--output', '-o', default='benchmark.json', help='JSON file for the results')
+    parser.add_argument('--baseline', '-b', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown against the baseline as a fraction')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.depths, args.min_time, args.games, args.seed, log=sys.stdout, repeat=args.repeat)
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'depths': args.depths, 'min_time': args.min_time, 'repeat': args.repeat,
+                   'games': args.games, 'seed': args.seed},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    for name, old_spread, new_spread in find_noisy(results, baseline, args.threshold):
+        print("WARNING: {} spread {:.1%} (baseline {:.1%}) is above the threshold, "
+              "the comparison is unreliable".format(name, new_spread, old_spread))
+    regressions = find_regressions(results, baseline, args.threshold)
+    for name, old, new, change in regressions:
+        print("REGRESSION: {} {:.1f} -> {:.1f} ({:+.1%})".format(name, old, new, change))
+    if regressions:
+        return 1
+    print("No regressions against {} (threshold {:.0%}).".format(args.baseline, args.threshold))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
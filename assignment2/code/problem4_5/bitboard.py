@@ -0,0 +1,407 @@
+from __future__ import absolute_import, division, print_function
+import random
+from move_tables import get_tables, move_line_left, LEFT, RIGHT, UP, DOWN, DELTA_MASK, GAIN_SHIFT, OVERFLOW_GAIN
+
+# Bitboard engine for the 4x4 game. A board is packed into a single 64-bit
+# integer holding the log2 value of every tile in a 4-bit nibble (0 = empty).
+# Cell (i, j) of the tile_matrix lives at bit offset 4 * (4 * i + j), so row i
+# of the matrix is the 16-bit value (board >> (16 * i)) & 0xFFFF.
+#
+# Directions follow Game.move: 0 merges each row towards j = 0, 1 merges each
+# column towards i = 0, 2 merges each row towards j = 3 and 3 merges each
+# column towards i = 3.
+#
+# A nibble holds tiles up to 32768: to_board raises OverflowError for larger
+# tiles and move raises it for a merge of two 32768 tiles. Games that can get
+# there use the 4x4 BoardEngine with 8-bit cells instead (see engine_for).
+
+BOARD_SIZE = 4
+ROW_MASK = 0xFFFF
+
+# log2 value of every tile a nibble can hold (0 for an empty cell)
+NIBBLE_RANKS = dict([(0, 0)] + [(1 << rank, rank) for rank in range(1, 16)])
+
+# board sizes supported by BoardEngine
+MIN_BOARD_SIZE = 3
+MAX_BOARD_SIZE = 8
+
+_tables = None
+_engines = {}
+
+
+def _load_tables():
+    global _tables
+    _tables = get_tables()
+    return _tables
+
+
+# packs a tile_matrix (list of lists of tile values) into a bitboard
+def to_board(tile_matrix):
+    board = 0
+    shift = 0
+    try:
+        for row in tile_matrix:
+            for tile in row:
+                if tile:
+                    board |= NIBBLE_RANKS[tile] << shift
+                shift += 4
+    except KeyError:
+        raise OverflowError("tile {} does not fit a 4-bit cell".format(tile))
+    return board
+
+
+# unpacks a bitboard into a fresh tile_matrix
+def to_tile_matrix(board):
+    tm = []
+    for i in range(BOARD_SIZE):
+        row = []
+        for j in range(BOARD_SIZE):
+            rank = (board >> (4 * (4 * i + j))) & 0xF
+            row.append(1 << rank if rank else 0)
+        tm.append(row)
+    return tm
+
+
+# transposes the board so that column i becomes row i
+def transpose(board):
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+# moves the board in the specified direction with one table lookup per row
+# (or per column on the transposed board); returns a (new board, score
+# gained) tuple
+def move(board, direction):
+    tables = _tables or _load_tables()
+    if direction == 0 or direction == 2:
+        table = tables[LEFT] if direction == 0 else tables[RIGHT]
+        e0 = table[board & ROW_MASK]
+        e1 = table[(board >> 16) & ROW_MASK]
+        e2 = table[(board >> 32) & ROW_MASK]
+        e3 = table[(board >> 48) & ROW_MASK]
+        delta = ((e0 & DELTA_MASK) | ((e1 & DELTA_MASK) << 16) |
+                 ((e2 & DELTA_MASK) << 32) | ((e3 & DELTA_MASK) << 48))
+    elif direction == 1 or direction == 3:
+        table = tables[UP] if direction == 1 else tables[DOWN]
+        t = transpose(board)
+        e0 = table[t & ROW_MASK]
+        e1 = table[(t >> 16) & ROW_MASK]
+        e2 = table[(t >> 32) & ROW_MASK]
+        e3 = table[(t >> 48) & ROW_MASK]
+        delta = ((e0 & DELTA_MASK) | ((e1 & DELTA_MASK) << 4) |
+                 ((e2 & DELTA_MASK) << 8) | ((e3 & DELTA_MASK) << 12))
+    else:
+        raise ValueError("invalid direction: {}".format(direction))
+    gain = (e0 >> GAIN_SHIFT) + (e1 >> GAIN_SHIFT) + (e2 >> GAIN_SHIFT) + (e3 >> GAIN_SHIFT)
+    if gain >= OVERFLOW_GAIN:
+        raise OverflowError("merging two 32768 tiles overflows a 4-bit cell")
+    return board ^ delta, gain
+
+
+# returns whether moving in the specified direction changes the board
+def can_move(board, direction):
+    return move(board, direction)[0] != board
+
+
+def game_over(board):
+    for direction in range(4):
+        if can_move(board, direction):
+            return False
+    return True
+
+
+# returns a list of all open (value 0) tiles in row-major order
+def get_open_tiles(board):
+    tiles = []
+    for x in range(BOARD_SIZE * BOARD_SIZE):
+        if not (board >> (4 * x)) & 0xF:
+            tiles.append((x // BOARD_SIZE, x % BOARD_SIZE))
+    return tiles
+
+
+# returns the board with a 2 placed on the given (i, j) tile
+def place_tile(board, tile):
+    i, j = tile
+    return board | (1 << (4 * (4 * i + j)))
+
+
+# places a 2 on a random open tile, drawing from the random module exactly
+# like Game.place_random_tile so that seeded games stay identical; a full
+# board is returned unchanged
+def place_random_tile(board):
+    tiles = get_open_tiles(board)
+    if not tiles:
+        return board
+    return place_tile(board, tiles[random.randrange(len(tiles))])
+
+
+# dict of line values that computes and stores missing entries on first
+# access; stands in for a full table when rows are too wide to enumerate
+class LazyTable(dict):
+    def __init__(self, compute):
+        dict.__init__(self)
+        self.compute = compute
+
+    def __missing__(self, row):
+        value = self[row] = self.compute(row)
+        return value
+
+
+# Move engine for n x n boards, MIN_BOARD_SIZE <= n <= MAX_BOARD_SIZE. The
+# board is packed into a Python int like the 4x4 bitboard, with cell (i, j)
+# at bit offset cell_bits * (n * i + j). Boards up to 4x4 use 4-bit cells by
+# default; larger boards, whose tiles can pass 2^15, use 8-bit cells (a 6x6
+# board is a 288-bit int), and so can smaller boards given cell_bits=8. Rows
+# are moved by lookups into per-row tables indexed by the packed row, which
+# are complete lists when a row fits in 16 bits and LazyTables otherwise;
+# columns are moved as rows of the transposed board. Like the module-level
+# move, move raises OverflowError for a merge that does not fit a cell. The
+# 4x4 engine with 4-bit cells simply exposes the module-level functions above.
+class BoardEngine:
+    def __init__(self, size, cell_bits=None):
+        if not MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE:
+            raise ValueError("board size must be between {} and {}, got {}".format(
+                MIN_BOARD_SIZE, MAX_BOARD_SIZE, size))
+        if cell_bits not in (None, 4, 8):
+            raise ValueError("cell_bits must be 4 or 8, got {}".format(cell_bits))
+        self.size = size
+        self.cell_bits = cell_bits or default_cell_bits(size)
+        self.cell_mask = (1 << self.cell_bits) - 1
+        self.row_bits = size * self.cell_bits
+        self.row_mask = (1 << self.row_bits) - 1
+        self.row_shifts = [self.row_bits * i for i in range(size)]
+
+        from heuristic import evaluate_board, evaluate_sized_board
+        if size == BOARD_SIZE and self.cell_bits == 4:
+            self.to_board = to_board
+            self.to_tile_matrix = to_tile_matrix
+            self.transpose = transpose
+            self.move = move
+            self.can_move = can_move
+            self.game_over = game_over
+            self.get_open_tiles = get_open_tiles
+            self.place_tile = place_tile
+            self.place_random_tile = place_random_tile
+            self.evaluate = evaluate_board
+            return
+        self.evaluate = lambda board, score: evaluate_sized_board(board, score, self)
+
+        if self.row_bits <= 16:
+            rows = range(1 << self.row_bits)
+            self.left = [self.move_row(row, False) for row in rows]
+            self.right = [self.move_row(row, True) for row in rows]
+            self.spread = [self.spread_row(row) for row in rows]
+        else:
+            self.left = LazyTable(lambda row: self.move_row(row, False))
+            self.right = LazyTable(lambda row: self.move_row(row, True))
+            self.spread = LazyTable(self.spread_row)
+
+    # list of the log2 values of a packed row
+    def row_ranks(self, row):
+        return [(row >> (self.cell_bits * j)) & self.cell_mask for j in range(self.size)]
+
+    def pack_row(self, ranks):
+        row = 0
+        for j, rank in enumerate(ranks):
+            row |= rank << (self.cell_bits * j)
+        return row
+
+    # (new row, score gained) of moving a packed row towards cell 0, or
+    # towards the last cell if reverse is set; (row, OVERFLOW_GAIN) if the
+    # move overflows a cell
+    def move_row(self, row, reverse):
+        ranks = self.row_ranks(row)
+        if reverse:
+            ranks.reverse()
+        try:
+            result, gain = move_line_left(ranks, self.cell_mask)
+        except OverflowError:
+            return row, OVERFLOW_GAIN
+        result += [0] * (self.size - len(result))
+        if reverse:
+            result.reverse()
+        return self.pack_row(result), gain
+
+    # spreads the cells of a packed row over column 0 of a board
+    def spread_row(self, row):
+        column = 0
+        for j, rank in enumerate(self.row_ranks(row)):
+            column |= rank << (self.row_bits * j)
+        return column
+
+    def to_board(self, tile_matrix):
+        if len(tile_matrix) != self.size:
+            raise ValueError("expected a {0}x{0} board, got {1}x{1}".format(self.size, len(tile_matrix)))
+        board = 0
+        shift = 0
+        top = 0
+        for row in tile_matrix:
+            for tile in row:
+                if tile:
+                    board |= (tile.bit_length() - 1) << shift
+                    top |= tile
+                shift += self.cell_bits
+        if top.bit_length() - 1 > self.cell_mask:
+            raise OverflowError("tile {} does not fit a {}-bit cell".format(top, self.cell_bits))
+        return board
+
+    def to_tile_matrix(self, board):
+        tm = []
+        for i in range(self.size):
+            row = []
+            for rank in self.row_ranks((board >> self.row_shifts[i]) & self.row_mask):
+                row.append(1 << rank if rank else 0)
+            tm.append(row)
+        return tm
+
+    def transpose(self, board):
+        t = 0
+        for i, shift in enumerate(self.row_shifts):
+            t |= self.spread[(board >> shift) & self.row_mask] << (self.cell_bits * i)
+        return t
+
+    # same directions and return value as the module-level move
+    def move(self, board, direction):
+        if direction == 0 or direction == 2:
+            lines = board
+        elif direction == 1 or direction == 3:
+            lines = self.transpose(board)
+        else:
+            raise ValueError("invalid direction: {}".format(direction))
+        table = self.left if direction < 2 else self.right
+        new_lines = 0
+        gain = 0
+        for shift in self.row_shifts:
+            row, row_gain = table[(lines >> shift) & self.row_mask]
+            new_lines |= row << shift
+            gain += row_gain
+        if gain >= OVERFLOW_GAIN:
+            raise OverflowError("a merge overflows a {}-bit cell".format(self.cell_bits))
+        if direction == 1 or direction == 3:
+            return self.transpose(new_lines), gain
+        return new_lines, gain
+
+    def can_move(self, board, direction):
+        return self.move(board, direction)[0] != board
+
+    def game_over(self, board):
+        for direction in range(4):
+            if self.can_move(board, direction):
+                return False
+        return True
+
+    def get_open_tiles(self, board):
+        tiles = []
+        for x in range(self.size * self.size):
+            if not (board >> (self.cell_bits * x)) & self.cell_mask:
+                tiles.append((x // self.size, x % self.size))
+        return tiles
+
+    def place_tile(self, board, tile):
+        i, j = tile
+        return board | (1 << (self.cell_bits * (self.size * i + j)))
+
+    def place_random_tile(self, board):
+        tiles = self.get_open_tiles(board)
+        if not tiles:
+            return board
+        return self.place_tile(board, tiles[random.randrange(len(tiles))])
+
+
+def default_cell_bits(size):
+    return 4 if size <= BOARD_SIZE else 8
+
+
+# shared BoardEngine for the given board size and cell width (by default 4
+# bits up to 4x4 and 8 bits above)
+def get_engine(size=BOARD_SIZE, cell_bits=None):
+    key = (size, cell_bits or default_cell_bits(size))
+    engine = _engines.get(key)
+    if engine is None:
+        engine = _engines[key] = BoardEngine(size, cell_bits)
+    return engine
+
+
+# whether a game on these tiles may need a tile above 32768 within `spawns`
+# more tile placements: that takes two 32768 tiles, and every placement adds
+# a 2 to the total
+def may_overflow_nibbles(tile_matrix, spawns=0):
+    return sum(sum(row) for row in tile_matrix) + 2 * spawns >= 1 << 16
+
+
+# BoardEngine for the board size of tile_matrix whose cells can hold every
+# tile reachable within `spawns` more placements: the default engine, or
+# 8-bit cells for small boards that may pass 32768
+def engine_for(tile_matrix, spawns=0):
+    size = len(tile_matrix)
+    if default_cell_bits(size) == 4 and may_overflow_nibbles(tile_matrix, spawns):
+        return get_engine(size, 8)
+    return get_engine(size)
+
+
+# Drop-in counterpart of Game backed by a packed board; 4x4 by default, or
+# the size of init_tile_matrix (see BoardEngine).
+class BitboardGame:
+    def __init__(self, init_tile_matrix = None, init_score = 0):
+        self.board_size = BOARD_SIZE
+        self.reset(init_tile_matrix, init_score)
+
+    def reset(self, init_tile_matrix = None, init_score = 0):
+        self.score = init_score
+        if init_tile_matrix is None:
+            self.engine = get_engine(self.board_size)
+            self.board = 0
+            self.place_random_tile()
+            self.place_random_tile()
+        else:
+            self.board_size = len(init_tile_matrix)
+            self.engine = engine_for(init_tile_matrix)
+            self.board = self.engine.to_board(init_tile_matrix)
+
+    @property
+    def tile_matrix(self):
+        return self.engine.to_tile_matrix(self.board)
+
+    def move_and_place(self, direction):
+        if self.move(direction):
+            self.place_random_tile()
+
+    # switches to 8-bit cells the first time a merge overflows 4-bit cells
+    def move(self, direction):
+        try:
+            new_board, gain = self.engine.move(self.board, direction)
+        except OverflowError:
+            if self.engine.cell_bits != 4:
+                raise
+            tile_matrix = self.tile_matrix
+            self.engine = get_engine(self.board_size, 8)
+            self.board = self.engine.to_board(tile_matrix)
+            new_board, gain = self.engine.move(self.board, direction)
+        if new_board == self.board:
+            return False
+        self.board = new_board
+        self.score += gain
+        return True
+
+    def place_random_tile(self):
+        self.board = self.engine.place_random_tile(self.board)
+
+    # unlike Game.can_move, the direction is explicit instead of implied
+    # by the current rotation of the matrix
+    def can_move(self, direction = 0):
+        return self.engine.can_move(self.board, direction)
+
+    def game_over(self):
+        return self.engine.game_over(self.board)
+
+    def get_open_tiles(self):
+        return self.engine.get_open_tiles(self.board)
+
+    def get_state(self):
+        return (self.tile_matrix, self.score)
@@ -1,23 +1,39 @@
 # NOTE: Do not modify.
-import copy, random
+import random
+
+# number of moves the UI can undo by default
+DEFAULT_UNDO_DEPTH = 100
+# bits per cell in the packed undo entries (log2 tile values up to 31)
+UNDO_CELL_BITS = 5
 
 # Game mechanics engine. Can be used by the UI or a simulator.
 class Game:
-    def __init__(self, init_tile_matrix = None, init_score = 0):
+    # undo_depth bounds the undo history; simulators that never undo
+    # should pass 0 to disable it
+    def __init__(self, init_tile_matrix = None, init_score = 0, undo_depth = DEFAULT_UNDO_DEPTH):
+        if undo_depth < 0:
+            raise ValueError("undo_depth must be at least 0, got {}".format(undo_depth))
         self.board_size = 4
+        self.undo_depth = undo_depth
         self.reset(init_tile_matrix, init_score)
 
     # resets the game using the given initialization state and total points
     def reset(self, init_tile_matrix = None, init_score = 0):
-        self.undoMat = []
+        # ring buffer of (packed tile_matrix, score) entries: undo_head is
+        # the slot of the next entry and undo_count the number of entries
+        self.undoMat = [None] * self.undo_depth
+        self.undo_head = 0
+        self.undo_count = 0
         self.score = init_score
         if init_tile_matrix == None:
             self.tile_matrix = self.new_tile_matrix()
+            self.open_cells = list(range(self.board_size ** 2))
 
             self.place_random_tile()
             self.place_random_tile()
         else:
-            self.tile_matrix = copy.deepcopy(init_tile_matrix)
+            self.tile_matrix = [row[:] for row in init_tile_matrix]
+            self.open_cells = None
         self.board_size = len(self.tile_matrix)
 
     def new_tile_matrix(self):
@@ -40,6 +56,8 @@ class Game:
             moved = True
         for j in range(0, (4 - direction) % 4):
             self.rotate_matrix_clockwise()
+        if moved:
+            self.open_cells = None
         return moved
 
     def move_tiles(self):
@@ -61,22 +79,78 @@ class Game:
                     self.score += tm[i][k]
                     self.move_tiles()
 
+    # places a 2 on an open tile chosen uniformly from the open cells;
+    # does nothing on a full board
     def place_random_tile(self):
-        while True:
-            i = random.randint(0,self.board_size-1)
-            j = random.randint(0,self.board_size-1)
-            if self.tile_matrix[i][j] == 0:
-                break
-        self.tile_matrix[i][j] = 2
+        cells = self.get_open_cells()
+        if not cells:
+            return
+        x = cells.pop(random.randrange(len(cells)))
+        self.tile_matrix[x // self.board_size][x % self.board_size] = 2
+
+    # returns the row-major indices i * board_size + j of the open tiles.
+    # This is a lazy cache, not an incrementally maintained list: reset, move
+    # and undo mark it stale (None) and the next call rescans tile_matrix, so
+    # listing the open tiles after a move still costs one pass over the board.
+    # It saves the scan only for states whose open tiles are never asked for,
+    # and place_random_tile removes its cell from it (an O(open tiles) pop
+    # that keeps the row-major order, and with it the random draws, of a
+    # full scan). Code that edits tile_matrix directly must set open_cells
+    # to None
+    def get_open_cells(self):
+        if self.open_cells is None:
+            cells = []
+            x = 0
+            for row in self.tile_matrix:
+                for tile in row:
+                    if tile == 0:
+                        cells.append(x)
+                    x += 1
+            self.open_cells = cells
+        return self.open_cells
 
     def undo(self):
-        if len(self.undoMat) > 0:
-            m = self.undoMat.pop()
-            self.tile_matrix = m[0]
+        if self.undo_count > 0:
+            self.undo_head = (self.undo_head - 1) % self.undo_depth
+            m = self.undoMat[self.undo_head]
+            self.undoMat[self.undo_head] = None
+            self.undo_count -= 1
+            self.tile_matrix = self.unpack_tile_matrix(m[0])
             self.score = m[1]
+            self.open_cells = None
 
+    # records the current state, overwriting the oldest entry once the
+    # history holds undo_depth states
     def addToUndo(self):
-        self.undoMat.append((copy.deepcopy(self.tile_matrix),self.score))
+        if not self.undo_depth:
+            return
+        self.undoMat[self.undo_head] = (self.pack_tile_matrix(), self.score)
+        self.undo_head = (self.undo_head + 1) % self.undo_depth
+        if self.undo_count < self.undo_depth:
+            self.undo_count += 1
+
+    # packs the log2 tile values into one int, UNDO_CELL_BITS per cell in
+    # row-major order
+    def pack_tile_matrix(self):
+        packed = 0
+        shift = 0
+        for row in self.tile_matrix:
+            for tile in row:
+                if tile:
+                    packed |= (tile.bit_length() - 1) << shift
+                shift += UNDO_CELL_BITS
+        return packed
+
+    def unpack_tile_matrix(self, packed):
+        mask = (1 << UNDO_CELL_BITS) - 1
+        tm = self.new_tile_matrix()
+        for i in range(self.board_size):
+            for j in range(self.board_size):
+                rank = packed & mask
+                if rank:
+                    tm[i][j] = 1 << rank
+                packed >>= UNDO_CELL_BITS
+        return tm
 
     def rotate_matrix_clockwise(self):
         tm = self.tile_matrix
@@ -130,14 +204,10 @@ class Game:
             new_tm[int(i / self.board_size)][i % self.board_size] = int(split[2 + i])
         self.reset(new_tm, new_score)
 
-    # returns a list of all open (value 0) tiles
+    # returns a list of all open (value 0) tiles in row-major order
     def get_open_tiles(self):
-        tiles = []
-        for i in range(0, self.board_size):
-            for j in range(0, self.board_size):
-                if self.tile_matrix[i][j] == 0:
-                    tiles.append((i, j))
-        return tiles
+        n = self.board_size
+        return [(x // n, x % n) for x in self.get_open_cells()]
 
     # returns a (tile_matrix, score) tuple representing the current game state
     def get_state(self):
@@ -0,0 +1,227 @@
+from __future__ import absolute_import, division, print_function
+import argparse, mmap, os, random, struct, sys
+from collections import namedtuple
+
+from bitboard import to_board, to_tile_matrix, BOARD_SIZE
+
+# Binary trace of played 4x4 games. The file is a fixed header followed by
+# fixed-size records, one per move, so record k sits at a known offset and
+# TraceReader can jump straight to it through mmap:
+#
+#     header: magic (8 bytes), format version (u32), record size (u32)
+#     record: board before the move (u64 bitboard), score before the move
+#             (u32), game index (u32), direction (u8), cell 4 * i + j of
+#             the tile spawned after the move (u8, NO_SPAWN if none)
+#
+# All fields are little-endian. TraceWriter only ever appends, so several
+# games (told apart by their game index) can be collected in one file.
+#
+#     with TraceWriter('games.trace') as writer:
+#         record_game(writer, 0, seed=1, search_depth=2)
+#     with TraceReader('games.trace') as reader:
+#         tile_matrix, score = reader.state(len(reader) - 1)
+#
+# or from the command line:
+#
+#     python game_trace.py record games.trace --games 5 --depth 2
+#     python game_trace.py verify games.trace
+
+TRACE_MAGIC = b"2048TR01"
+TRACE_VERSION = 1
+HEADER = struct.Struct("<8sII")
+RECORD = struct.Struct("<QIIBB")
+NO_SPAWN = 255
+
+TraceRecord = namedtuple('TraceRecord', ['board', 'score', 'game', 'direction', 'spawn'])
+
+
+class TraceError(ValueError):
+    pass
+
+
+# cell index of the tile that turns moved_board into placed_board, or
+# NO_SPAWN if they are equal
+def spawn_cell(moved_board, placed_board):
+    diff = moved_board ^ placed_board
+    if not diff:
+        return NO_SPAWN
+    return (diff.bit_length() - 1) // 4
+
+
+def _check_header(data, filename):
+    if len(data) < HEADER.size:
+        raise TraceError("{}: truncated trace header".format(filename))
+    magic, version, record_size = HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC:
+        raise TraceError("{}: not a trace file".format(filename))
+    if version != TRACE_VERSION or record_size != RECORD.size:
+        raise TraceError("{}: unsupported trace version {} (record size {})".format(
+            filename, version, record_size))
+
+
+class TraceWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, "ab")
+        if self.f.tell() == 0:
+            self.f.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, RECORD.size))
+        else:
+            with open(filename, "rb") as f:
+                _check_header(f.read(HEADER.size), filename)
+            # drop a partial record left by an interrupted writer
+            excess = (self.f.tell() - HEADER.size) % RECORD.size
+            if excess:
+                self.f.truncate(self.f.tell() - excess)
+                self.f.seek(0, os.SEEK_END)
+
+    def append(self, board, score, game, direction, spawn=NO_SPAWN):
+        self.f.write(RECORD.pack(board, score, game, direction, spawn))
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TraceReader:
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, "rb")
+        size = os.fstat(self.f.fileno()).st_size
+        if size < HEADER.size:
+            self.f.close()
+            raise TraceError("{}: truncated trace header".format(filename))
+        self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        _check_header(self.data, filename)
+        # a trailing partial record (writer still running) is ignored
+        self.num_records = (size - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self.num_records
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += self.num_records
+        if not 0 <= k < self.num_records:
+            raise IndexError("trace record {} out of range".format(k))
+        return TraceRecord(*RECORD.unpack_from(self.data, HEADER.size + k * RECORD.size))
+
+    def __iter__(self):
+        for fields in RECORD.iter_unpack(self.data[HEADER.size:HEADER.size + self.num_records * RECORD.size]):
+            yield TraceRecord(*fields)
+
+    # (tile_matrix, score) state before move k
+    def state(self, k):
+        record = self[k]
+        return (to_tile_matrix(record.board), record.score)
+
+    def close(self):
+        self.data.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# plays one seeded game with the AI (compute_decision by default) and
+# appends its moves to writer as game number game; returns the final state
+def record_game(writer, game, seed=None, search_depth=2, decision='compute_decision', max_moves=None):
+    from game import Game
+    from ai import AI
+
+    if seed is not None:
+        random.seed(seed)
+    g = Game(undo_depth=0)
+    moves = 0
+    while not g.game_over() and (max_moves is None or moves < max_moves):
+        board = to_board(g.tile_matrix)
+        score = g.score
+        direction = getattr(AI(g.get_state(), search_depth), decision)()
+        if not g.move(direction):
+            # a no-op decision would repeat forever
+            writer.append(board, score, game, direction)
+            break
+        moved_board = to_board(g.tile_matrix)
+        g.place_random_tile()
+        writer.append(board, score, game, direction, spawn_cell(moved_board, to_board(g.tile_matrix)))
+        moves += 1
+    return g.get_state()
+
+
+# replays the records of one game with the bitboard engine and checks that
+# every move and spawn leads to the next recorded position; returns the
+# number of records checked
+def verify_game(reader, game):
+    import bitboard
+    previous = None
+    checked = 0
+    for record in reader:
+        if record.game != game:
+            continue
+        if previous is not None:
+            board, gain = bitboard.move(previous.board, previous.direction)
+            if previous.spawn != NO_SPAWN:
+                board = bitboard.place_tile(board, divmod(previous.spawn, BOARD_SIZE))
+            if board != record.board or previous.score + gain != record.score:
+                raise TraceError("{}: game {} diverges at record {}".format(reader.filename, game, checked))
+        previous = record
+        checked += 1
+    return checked
+
+
+# index of the next game to append to a trace file (0 for a new file)
+def next_game_index(filename):
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return 0
+    with TraceReader(filename) as reader:
+        return max(record.game for record in reader) + 1 if len(reader) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record and verify binary 2048 game traces.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    record = commands.add_parser('record', help='play seeded AI games and append them to a trace')
+    record.add_argument('trace', help='trace file (created or appended to)')
+    record.add_argument('--games', '-n', type=int, default=1, help='number of games')
+    record.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    record.add_argument('--depth', type=int, default=2, help='search depth of the AI')
+    record.add_argument('--decision', default='compute_decision', help='AI decision method')
+    record.add_argument('--max-moves', type=int, default=None, help='stop each game after this many moves')
+    verify = commands.add_parser('verify', help='replay every game of a trace with the bitboard engine')
+    verify.add_argument('trace', help='trace file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        first_game = next_game_index(args.trace)
+        with TraceWriter(args.trace) as writer:
+            for k in range(args.games):
+                _, score = record_game(writer, first_game + k, args.seed + k, args.depth, args.decision,
+                                       args.max_moves)
+                writer.flush()
+                print("game {} (seed {}): score {}".format(first_game + k, args.seed + k, score))
+        return 0
+
+    with TraceReader(args.trace) as reader:
+        games = sorted(set(record.game for record in reader))
+        try:
+            for game in games:
+                print("game {}: {} records verified".format(game, verify_game(reader, game)))
+        except TraceError as e:
+            print("FAILED: {}".format(e))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,354 @@
+from __future__ import absolute_import, division, print_function
+import hashlib, inspect, os
+from array import array
+from bitboard import transpose, to_board, engine_for, LazyTable, MIN_BOARD_SIZE, MAX_BOARD_SIZE
+
+# Evaluation function of custom_expectimax. custom_evaluation is the
+# reference per-cell implementation on a tile matrix; evaluate_board computes
+# exactly the same score on a packed 4x4 bitboard with 8 lookups into
+# per-row tables (4 rows, 4 columns of the transposed board), and
+# evaluate_sized_board does the same for the other sizes of BoardEngine.
+
+# heuristic weights of custom_evaluation
+GAME_SCORE_WEIGHT = 2
+SUM_TILE_WEIGHT = 0
+OPEN_TILE_WEIGHT = 800
+POT_MERGE_WEIGHT = 500
+MAX_TILE_WEIGHT = 10
+MONOTONIC_SCORE = 0
+CORNER_WEIGHT = 0
+PENALTY_WEIGHT = 0
+
+# names of the weights above and their default values; the tables below bake
+# the weights in, so call build_heuristic_tables after changing any of them
+# (set_weights does both)
+WEIGHT_NAMES = ('GAME_SCORE_WEIGHT', 'SUM_TILE_WEIGHT', 'OPEN_TILE_WEIGHT', 'POT_MERGE_WEIGHT',
+                'MAX_TILE_WEIGHT', 'MONOTONIC_SCORE', 'CORNER_WEIGHT', 'PENALTY_WEIGHT')
+DEFAULT_WEIGHTS = dict((name, globals()[name]) for name in WEIGHT_NAMES)
+
+# {weight name: value} of the current weights
+def current_weights():
+    return dict((name, globals()[name]) for name in WEIGHT_NAMES)
+
+# sets the weights in the {weight name: value} dict, rebuilding the tables
+# if anything changed; returns whether anything changed
+def set_weights(weights):
+    for name in weights:
+        if name not in WEIGHT_NAMES:
+            raise ValueError("unknown weight '{}'".format(name))
+    if all(globals()[name] == value for name, value in weights.items()):
+        return False
+    globals().update(weights)
+    build_heuristic_tables()
+    return True
+
+# weight matrix
+# CORNER_WEIGHT_MATRIX = [[6,5,4,3],[5,4,3,2],[4,3,2,1],[3,2,1,0]]
+CORNER_WEIGHT_MATRIX = [[16,15,14,13],[9,10,11,12],[8,7,6,5],[1,2,3,4]]
+# CORNER_WEIGHT_MATRIX = [[pow(2,16),pow(2,15),pow(2,14),pow(2,13)],[pow(2,9),pow(2,10),pow(2,11),pow(2,12)],[pow(2,8),pow(2,7),pow(2,6),pow(2,5)],[pow(2,1),pow(2,2),pow(2,3),pow(2,4)]]
+
+# snake-shaped weight matrix of any size, following CORNER_WEIGHT_MATRIX:
+# n*n in the top-left corner, decreasing along each row and turning around
+# at the ends
+def corner_weight_matrix(size):
+    if size == 4:
+        return CORNER_WEIGHT_MATRIX
+    matrix = []
+    for i in range(size):
+        row = [(size - 1 - i) * size + k + 1 for k in range(size)]
+        if i % 2 == 0:
+            row.reverse()
+        matrix.append(row)
+    return matrix
+
+# custom evaluation function used at the leaves of custom_expectimax
+def custom_evaluation(node_tile_matrix, node_game_score):
+    size = len(node_tile_matrix)
+    weight_matrix = corner_weight_matrix(size)
+
+    # find the highest tile
+    highest_tile = max(max(row) for row in node_tile_matrix)
+
+    # find the total sum of the tile matrix
+    sum_tiles = sum(sum(row) for row in node_tile_matrix)
+
+    # compute the number of open tiles
+    # open_tiles = []
+    num_open_tiles = 0
+    num_pot_merges = 0
+    num_monotonic_dec = 0
+    num_monotonic_inc = 0
+    corner_score = 0
+    penalty = 0
+
+    for i in range(0, size):
+        for j in range(0, size):
+            if node_tile_matrix[i][j] == 0:
+                # open_tiles.append((i, j))
+                num_open_tiles += 1
+
+            if j > 0:
+                if node_tile_matrix[i][j-1] == node_tile_matrix[i][j]:
+                    num_pot_merges += 1
+
+                if node_tile_matrix[i][j-1] > node_tile_matrix[i][j]:
+                    num_monotonic_dec += 1
+                elif node_tile_matrix[i][j-1] < node_tile_matrix[i][j]:
+                    num_monotonic_inc += 1
+
+            if i > 0:
+                if node_tile_matrix[i-1][j] == node_tile_matrix[i][j]:
+                    num_pot_merges += 1
+                
+                if node_tile_matrix[i-1][j] > node_tile_matrix[i][j]:
+                    num_monotonic_dec += 1
+                elif node_tile_matrix[i-1][j] < node_tile_matrix[i][j]:
+                    num_monotonic_inc += 1
+
+            corner_score += weight_matrix[i][j]*node_tile_matrix[i][j]
+
+
+            if j > 0:
+                penalty += abs(node_tile_matrix[i][j] - node_tile_matrix[i][j-1])
+            if i > 0:
+                penalty += abs(node_tile_matrix[i][j] - node_tile_matrix[i-1][j])
+            if i < size - 1:
+                penalty += abs(node_tile_matrix[i][j] - node_tile_matrix[i+1][j])
+            if j < size - 1:
+                penalty += abs(node_tile_matrix[i][j] - node_tile_matrix[i][j+1])
+
+
+    custom_score = (GAME_SCORE_WEIGHT*node_game_score + 
+                    SUM_TILE_WEIGHT*sum_tiles +
+                    MAX_TILE_WEIGHT*highest_tile + 
+                    OPEN_TILE_WEIGHT*num_open_tiles + 
+                    POT_MERGE_WEIGHT*num_pot_merges -
+                    MONOTONIC_SCORE*min(num_monotonic_inc, num_monotonic_dec) +
+                    CORNER_WEIGHT*corner_score -
+                    PENALTY_WEIGHT*penalty
+                    )
+    
+    # print(SUM_TILE_WEIGHT*sum_tiles, OPEN_TILE_WEIGHT*num_open_tiles, POT_MERGE_WEIGHT*num_pot_merges, CORNER_WEIGHT*corner_score)
+    # custom_score = 0.2*highest_tile + 0.4*num_open_tiles*1000 + 0.4*num_pot_merges*1000
+    # assert(custom_score > 0)
+    return custom_score
+
+# per-row lookup tables, built on first use: ROW_TABLES[i][row] holds the
+# (linear score, monotonicity counts, highest tile) of row i and
+# COL_TABLE[row] the (linear score, monotonicity counts) of a column.
+# Monotonicity counts are packed as inc | (dec << 8).
+_row_tables = None
+_col_table = None
+
+# the same (row tables, column table) pair for every other board size and
+# cell width, as LazyTables keyed by (size, cell_bits)
+_sized_tables = {}
+
+# (row tables, column table, sized tables) of every weight set used so far in
+# this process, keyed by the tuple of weight values in WEIGHT_NAMES order, so
+# that switching back to a weight set costs nothing
+_table_sets = {}
+
+# The 4x4 tables take about a second to compute, so they are also cached on
+# disk, one file per weight set in CACHE_DIR. The file name and header hold a
+# hash of the weights and of the code that computes the tables.
+CACHE_DIR = os.environ.get("HEURISTIC_TABLES_CACHE", os.path.dirname(os.path.abspath(__file__)))
+CACHE_MAGIC = b"2048HT01"
+
+
+def _line_features(row, size=4, cell_bits=4):
+    cell_mask = (1 << cell_bits) - 1
+    tiles = [(1 << rank) if rank else 0 for rank in ((row >> (cell_bits * j)) & cell_mask for j in range(size))]
+    merges = 0
+    inc = 0
+    dec = 0
+    penalty = 0
+    for j in range(1, size):
+        if tiles[j-1] == tiles[j]:
+            merges += 1
+        if tiles[j-1] > tiles[j]:
+            dec += 1
+        elif tiles[j-1] < tiles[j]:
+            inc += 1
+        # every neighbour pair is penalised from both of its cells
+        penalty += 2 * abs(tiles[j] - tiles[j-1])
+    return tiles, merges, inc | (dec << 8), penalty
+
+
+# computes the (row tables, column table) of the current weights from scratch
+def compute_heuristic_tables():
+    row_tables = [[None] * (1 << 16) for _ in range(4)]
+    col_table = [None] * (1 << 16)
+    for row in range(1 << 16):
+        tiles, merges, mono, penalty = _line_features(row)
+        num_open_tiles = tiles.count(0)
+        line_score = POT_MERGE_WEIGHT*merges - PENALTY_WEIGHT*penalty
+        row_score = OPEN_TILE_WEIGHT*num_open_tiles + SUM_TILE_WEIGHT*sum(tiles) + line_score
+        highest_tile = max(tiles)
+        for i in range(4):
+            corner_score = sum(CORNER_WEIGHT_MATRIX[i][j]*tiles[j] for j in range(4))
+            row_tables[i][row] = (row_score + CORNER_WEIGHT*corner_score, mono, highest_tile)
+        col_table[row] = (line_score, mono)
+    return row_tables, col_table
+
+
+# hash of the weights (a tuple of values) and of the code and constants that
+# compute the tables, stored in the cache header
+def cache_version(weights):
+    h = hashlib.sha256()
+    for function in (_line_features, compute_heuristic_tables):
+        h.update(inspect.getsource(function).encode("utf-8"))
+    h.update(repr((CORNER_WEIGHT_MATRIX, weights)).encode("utf-8"))
+    return h.digest()
+
+
+def cache_filename(version):
+    return os.path.join(CACHE_DIR, "heuristic_tables.{}.cache".format(hashlib.sha256(version).hexdigest()[:16]))
+
+
+# writes the tables as arrays: the four row scores and the column scores
+# (int64, or double if any weight is a float), then the monotonicity counts
+# and highest tiles shared by rows and columns
+def save_heuristic_tables(row_tables, col_table, version, filename):
+    scores = [[entry[0] for entry in table] for table in row_tables + [col_table]]
+    typecode = b"q" if all(isinstance(value, int) for table in scores for value in table) else b"d"
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp_filename, "wb") as f:
+        f.write(CACHE_MAGIC)
+        f.write(version)
+        f.write(typecode)
+        for table in scores:
+            array(typecode.decode(), table).tofile(f)
+        array("I", [entry[1] for entry in col_table]).tofile(f)
+        array("I", [entry[2] for entry in row_tables[0]]).tofile(f)
+    os.replace(tmp_filename, filename)
+
+
+# returns the cached (row tables, column table), or None if the cache file is
+# missing or was written for other weights or table code
+def load_heuristic_tables(version, filename):
+    try:
+        with open(filename, "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC or f.read(len(version)) != version:
+                return None
+            typecode = f.read(1).decode()
+            if typecode not in ("q", "d"):
+                return None
+            scores = []
+            for _ in range(5):
+                table = array(typecode)
+                table.fromfile(f, 1 << 16)
+                scores.append(table)
+            mono = array("I")
+            mono.fromfile(f, 1 << 16)
+            highest = array("I")
+            highest.fromfile(f, 1 << 16)
+    except (IOError, OSError, EOFError, UnicodeDecodeError):
+        return None
+    return [list(zip(table, mono, highest)) for table in scores[:4]], list(zip(scores[4], mono))
+
+
+# returns the (row tables, column table) of the current weights from the
+# cache file, computing and caching them if needed
+def load_or_build_heuristic_tables():
+    version = cache_version(tuple(globals()[name] for name in WEIGHT_NAMES))
+    filename = cache_filename(version)
+    loaded = load_heuristic_tables(version, filename)
+    if loaded is None:
+        loaded = compute_heuristic_tables()
+        try:
+            save_heuristic_tables(loaded[0], loaded[1], version, filename)
+        except (IOError, OSError):
+            pass
+    return loaded
+
+
+# (re)selects the tables of the current weights, loading or building them the
+# first time a weight set is used; call it again after changing any weight
+# at runtime
+def build_heuristic_tables():
+    global _row_tables, _col_table, _sized_tables
+    weights = tuple(globals()[name] for name in WEIGHT_NAMES)
+    tables = _table_sets.get(weights)
+    if tables is None:
+        row_tables, col_table = load_or_build_heuristic_tables()
+        tables = _table_sets[weights] = (row_tables, col_table, {})
+    _row_tables, _col_table, _sized_tables = tables
+
+
+# table-driven custom_evaluation of a packed 4x4 bitboard
+def evaluate_board(board, score):
+    if _row_tables is None:
+        build_heuristic_tables()
+    r0 = _row_tables[0][board & 0xFFFF]
+    r1 = _row_tables[1][(board >> 16) & 0xFFFF]
+    r2 = _row_tables[2][(board >> 32) & 0xFFFF]
+    r3 = _row_tables[3][(board >> 48) & 0xFFFF]
+    t = transpose(board)
+    c0 = _col_table[t & 0xFFFF]
+    c1 = _col_table[(t >> 16) & 0xFFFF]
+    c2 = _col_table[(t >> 32) & 0xFFFF]
+    c3 = _col_table[(t >> 48) & 0xFFFF]
+    mono = r0[1] + r1[1] + r2[1] + r3[1] + c0[1] + c1[1] + c2[1] + c3[1]
+    return (GAME_SCORE_WEIGHT*score +
+            MAX_TILE_WEIGHT*max(r0[2], r1[2], r2[2], r3[2]) +
+            r0[0] + r1[0] + r2[0] + r3[0] + c0[0] + c1[0] + c2[0] + c3[0] -
+            MONOTONIC_SCORE*min(mono & 0xFF, mono >> 8))
+
+
+def _sized_row_features(engine, i, row):
+    tiles, merges, mono, penalty = _line_features(row, engine.size, engine.cell_bits)
+    weight_row = corner_weight_matrix(engine.size)[i]
+    line_score = POT_MERGE_WEIGHT*merges - PENALTY_WEIGHT*penalty
+    row_score = (OPEN_TILE_WEIGHT*tiles.count(0) + SUM_TILE_WEIGHT*sum(tiles) + line_score +
+                 CORNER_WEIGHT*sum(w*tile for w, tile in zip(weight_row, tiles)))
+    return (row_score, mono, max(tiles))
+
+
+def _sized_column_features(engine, row):
+    _, merges, mono, penalty = _line_features(row, engine.size, engine.cell_bits)
+    return (POT_MERGE_WEIGHT*merges - PENALTY_WEIGHT*penalty, mono)
+
+
+# custom_evaluation of a board packed by engine (a bitboard.BoardEngine of
+# any size), with one lookup per row and per column
+def evaluate_sized_board(board, score, engine):
+    tables = _sized_tables.get((engine.size, engine.cell_bits))
+    if tables is None:
+        row_tables = [LazyTable(lambda row, i=i: _sized_row_features(engine, i, row))
+                      for i in range(engine.size)]
+        col_table = LazyTable(lambda row: _sized_column_features(engine, row))
+        tables = _sized_tables[(engine.size, engine.cell_bits)] = (row_tables, col_table)
+    row_tables, col_table = tables
+
+    row_mask = engine.row_mask
+    total = GAME_SCORE_WEIGHT*score
+    mono = 0
+    highest_tile = 0
+    for i, shift in enumerate(engine.row_shifts):
+        row_score, row_mono, row_highest = row_tables[i][(board >> shift) & row_mask]
+        total += row_score
+        mono += row_mono
+        if row_highest > highest_tile:
+            highest_tile = row_highest
+    t = engine.transpose(board)
+    for shift in engine.row_shifts:
+        col_score, col_mono = col_table[(t >> shift) & row_mask]
+        total += col_score
+        mono += col_mono
+    return total + MAX_TILE_WEIGHT*highest_tile - MONOTONIC_SCORE*min(mono & 0xFF, mono >> 8)
+
+
+# custom evaluation of a (tile_matrix, score) state, using the tables
+# whenever the board size is supported by BoardEngine
+def evaluate_state(tile_matrix, score):
+    size = len(tile_matrix)
+    if size == 4:
+        try:
+            return evaluate_board(to_board(tile_matrix), score)
+        except OverflowError:
+            pass
+    if MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE:
+        engine = engine_for(tile_matrix)
+        return engine.evaluate(engine.to_board(tile_matrix), score)
+    return custom_evaluation(tile_matrix, score)
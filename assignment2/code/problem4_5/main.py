@@ -2,7 +2,7 @@
 from __future__ import absolute_import, division, print_function
 import sys, time, math, random, os, argparse
 from game import Game
-from ai import AI
+from session import AISession
 from test import test, test_ec
 
 TREE_DEPTH = 3
@@ -52,6 +52,9 @@ class GameRunner:
         self.game = Game()
         self.auto = False
         self.ec = False
+        # keeps the search tree between the AI's moves; it checks every state
+        # against its tree, so resets, loads and undos just start a new tree
+        self.session = AISession(TREE_DEPTH)
 
     def loop(self):
         while True:
@@ -90,11 +93,8 @@ class GameRunner:
                         self.grayscale = not self.grayscale
 
             if self.auto and not game_over:
-                ai = AI(self.game.get_state(), TREE_DEPTH)
-                if not self.ec:
-                    direction = ai.compute_decision() 
-                else:
-                    direction = ai.compute_decision_ec() 
+                self.session.ec = self.ec
+                direction = self.session.compute_decision(self.game.get_state())
 
             if direction != None:
                 self.game.move_and_place(direction)
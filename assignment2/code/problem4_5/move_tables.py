@@ -0,0 +1,187 @@
+from __future__ import absolute_import, division, print_function
+import hashlib, inspect, os, struct
+from array import array
+
+# Precomputed shift-and-merge results for every 16-bit row of four log2
+# nibbles. Each table has one entry per row state, packed as
+#     delta | (score gained << 64)
+# where xor-ing delta into the board applies the move. LEFT/RIGHT deltas are
+# plain 16-bit rows, UP/DOWN deltas are spread over a 64-bit column
+# (cell j at bit 16 * j) so that a transposed row can be xor-ed straight back
+# into the untransposed board.
+#
+# A nibble holds ranks up to 15 (32768), so a row that would merge two 32768
+# tiles cannot be represented: its entry has no delta and the gain
+# OVERFLOW_GAIN, which no real row reaches, and bitboard.move raises
+# OverflowError when it looks one up.
+#
+# The tables are built on first use and cached on disk in CACHE_FILE. The
+# cache header holds a hash of the code and parameters that build the tables
+# (cache_version), so a cache written by older table logic is rebuilt.
+
+NUM_ROWS = 1 << 16
+DELTA_MASK = (1 << 64) - 1
+GAIN_SHIFT = 64
+# gain marking a row whose move overflows a cell (fits the 32-bit gain array)
+OVERFLOW_GAIN = 1 << 31
+
+CACHE_FILE = os.environ.get(
+    "MOVE_TABLES_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "move_tables.cache"))
+CACHE_MAGIC = b"2048MT02"
+
+LEFT, RIGHT, UP, DOWN = 0, 1, 2, 3
+
+_tables = None
+
+
+# reverses the order of the four cells in a 16-bit row
+def reverse_row(row):
+    return (((row & 0xF) << 12) | ((row & 0xF0) << 4) |
+            ((row >> 4) & 0xF0) | ((row >> 12) & 0xF))
+
+
+# spreads the four cells of a 16-bit row over a column of a 64-bit board
+def spread_column(row):
+    return ((row & 0xF) | ((row & 0xF0) << 12) |
+            ((row & 0xF00) << 24) | ((row & 0xF000) << 36))
+
+
+# slides and merges a list of log2 tile values towards index 0 the same way
+# Game.move_tiles / Game.merge_tiles do; returns (list of the non-empty
+# values, score gained). Raises OverflowError if a merge would produce a
+# rank above max_rank.
+def move_line_left(ranks, max_rank=0xF):
+    tiles = [rank for rank in ranks if rank]
+    result = []
+    gain = 0
+    k = 0
+    while k < len(tiles):
+        if k + 1 < len(tiles) and tiles[k] == tiles[k + 1]:
+            rank = tiles[k] + 1
+            if rank > max_rank:
+                raise OverflowError("merging two 2^{} tiles overflows a {}-bit cell".format(
+                    tiles[k], max_rank.bit_length()))
+            result.append(rank)
+            gain += 1 << rank
+            k += 2
+        else:
+            result.append(tiles[k])
+            k += 1
+    return result, gain
+
+
+# slides and merges a 16-bit row towards cell 0; returns (new row, score
+# gained)
+def move_row_left(row):
+    result, gain = move_line_left([(row >> (4 * j)) & 0xF for j in range(4)])
+    new_row = 0
+    for j, rank in enumerate(result):
+        new_row |= rank << (4 * j)
+    return new_row, gain
+
+
+# slides and merges a 16-bit row towards cell 3
+def move_row_right(row):
+    new_row, gain = move_row_left(reverse_row(row))
+    return reverse_row(new_row), gain
+
+
+# (new row, score gained) of moving a row towards cell 0, or towards cell 3
+# if reverse is set; (row, OVERFLOW_GAIN) if the move overflows a cell
+def table_entry(row, reverse):
+    try:
+        return move_row_right(row) if reverse else move_row_left(row)
+    except OverflowError:
+        return row, OVERFLOW_GAIN
+
+
+# computes the (deltas, gains) arrays of all four tables from scratch
+def build_tables():
+    deltas = [array("Q", bytes(8 * NUM_ROWS)) for _ in range(4)]
+    gains = [array("I", bytes(4 * NUM_ROWS)) for _ in range(4)]
+    for row in range(NUM_ROWS):
+        left, left_gain = table_entry(row, False)
+        right, right_gain = table_entry(row, True)
+        deltas[LEFT][row] = left ^ row
+        deltas[RIGHT][row] = right ^ row
+        deltas[UP][row] = spread_column(left ^ row)
+        deltas[DOWN][row] = spread_column(right ^ row)
+        gains[LEFT][row] = gains[UP][row] = left_gain
+        gains[RIGHT][row] = gains[DOWN][row] = right_gain
+    return deltas, gains
+
+
+# hash of the functions and parameters that determine the table contents,
+# stored in the cache header
+def cache_version():
+    h = hashlib.sha256()
+    for function in (reverse_row, spread_column, move_line_left, move_row_left, move_row_right,
+                     table_entry, build_tables):
+        h.update(inspect.getsource(function).encode("utf-8"))
+    h.update(struct.pack("<IIQ", NUM_ROWS, GAIN_SHIFT, OVERFLOW_GAIN))
+    return h.digest()
+
+
+def save_tables(deltas, gains, filename=CACHE_FILE):
+    tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp_filename, "wb") as f:
+        f.write(CACHE_MAGIC)
+        f.write(cache_version())
+        f.write(struct.pack("<I", NUM_ROWS))
+        for table in deltas:
+            table.tofile(f)
+        for table in gains:
+            table.tofile(f)
+    os.replace(tmp_filename, filename)
+
+
+# returns the cached (deltas, gains) arrays, or None if the cache file is
+# missing, does not match the current format or was built by other table code
+def load_tables(filename=CACHE_FILE):
+    try:
+        with open(filename, "rb") as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            version = cache_version()
+            if f.read(len(version)) != version:
+                return None
+            if struct.unpack("<I", f.read(4))[0] != NUM_ROWS:
+                return None
+            deltas = []
+            for _ in range(4):
+                table = array("Q")
+                table.fromfile(f, NUM_ROWS)
+                deltas.append(table)
+            gains = []
+            for _ in range(4):
+                table = array("I")
+                table.fromfile(f, NUM_ROWS)
+                gains.append(table)
+    except (IOError, OSError, EOFError, struct.error):
+        return None
+    return deltas, gains
+
+
+# returns the (deltas, gains) arrays from the cache file, building and
+# caching them if needed
+def load_or_build_tables():
+    loaded = load_tables()
+    if loaded is None:
+        loaded = build_tables()
+        try:
+            save_tables(*loaded)
+        except (IOError, OSError):
+            pass
+    return loaded
+
+
+# returns the LEFT, RIGHT, UP, DOWN tables as lists of packed entries,
+# loading them from disk or building (and caching) them on first use
+def get_tables():
+    global _tables
+    if _tables is None:
+        deltas, gains = load_or_build_tables()
+        _tables = tuple([d | (g << GAIN_SHIFT) for d, g in zip(deltas[k], gains[k])]
+                        for k in range(4))
+    return _tables
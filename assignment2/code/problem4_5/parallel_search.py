@@ -0,0 +1,60 @@
+from __future__ import absolute_import, division, print_function
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+
+import bitboard
+import heuristic
+from transposition import TranspositionTable
+
+# Process pool used by AI.compute_decision_parallel. The pool is created on
+# first use and reused for every later decision; only packed bitboards,
+# scores and the heuristic weights travel between processes. Workers outlive
+# any weight change in the parent, so every task carries the weights and the
+# worker sets them (rebuilding its tables only when they differ).
+
+_pool = None
+_pool_workers = None
+
+# per-worker search state, kept between tasks so that each worker's
+# transposition table stays warm across decisions. Its keys include the
+# probability cutoff, and pruned subtrees are never stored, so tasks with
+# different cutoffs can share it; custom_expectimax values depend on the
+# heuristic weights, so it is cleared when they change.
+_worker_cache = None
+
+
+def get_pool(max_workers=None):
+    global _pool, _pool_workers
+    if _pool is None or (max_workers is not None and max_workers != _pool_workers):
+        shutdown_pool()
+        _pool = ProcessPoolExecutor(max_workers=max_workers)
+        _pool_workers = max_workers
+    return _pool
+
+
+def shutdown_pool():
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+        _pool_workers = None
+
+atexit.register(shutdown_pool)
+
+
+# worker entry point: expectimax value of one subtree given as
+# (board, score, player_type, depth, search_depth, ec, prob, prob_cutoff,
+# {heuristic weight name: value}); returns a (value, pruned nodes) tuple
+def score_subtree(task):
+    global _worker_cache
+    from ai import AI
+    board, score, player_type, depth, search_depth, ec, prob, prob_cutoff, weights = task
+    if heuristic.set_weights(weights) or _worker_cache is None:
+        _worker_cache = TranspositionTable()
+    ai = AI((bitboard.to_tile_matrix(board), score), search_depth, cache=_worker_cache,
+            prob_cutoff=prob_cutoff)
+    # tasks carry 4-bit 4x4 boards (compute_decision_parallel only sends
+    # boards that cannot overflow a nibble)
+    ai.engine = bitboard.get_engine()
+    _, value = ai.stream_expectimax(board, score, player_type, depth, ec, prob)
+    return value, ai.pruned_nodes
@@ -0,0 +1,171 @@
+from __future__ import absolute_import, division, print_function
+import time
+from collections import deque
+
+# Optional statistics collector for AI searches. Pass a SearchStats to
+# AI(..., stats=stats); with stats=None (the default) the search only pays
+# for one `is not None` check per node.
+#
+# Each decision produces a DecisionRecord; the last `window` records are kept
+# for rolling aggregates, e.g. for printing from test_ec or the GUI:
+#     stats = SearchStats()
+#     direction = AI(game.get_state(), stats=stats).compute_decision()
+#     print(stats.last)
+#     print(stats.summary())
+
+MAX_PLAYER, CHANCE_PLAYER = 0, 1
+
+
+# solves nodes = b + b^2 + ... + b^depth for b by bisection
+def effective_branching_factor(nodes, depth):
+    if depth <= 0 or nodes <= 0:
+        return 0.0
+    if nodes <= depth:
+        return 1.0
+    lo, hi = 1.0, float(nodes)
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if sum(mid ** i for i in range(1, depth + 1)) < nodes:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+# statistics of a single decision
+class DecisionRecord:
+    def __init__(self, search_depth):
+        self.search_depth = search_depth
+        # nodes expanded (given children) per player type
+        self.expanded = [0, 0]
+        self.leaves = 0
+        self.tree_nodes = 0
+        # nodes of a reused tree (session.AISession) kept from the previous
+        # decision; they are included in the other counts
+        self.reused_nodes = 0
+        self.peak_nodes = 0
+        self.build_time = 0.0
+        self.eval_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.pruned_nodes = 0
+
+    @property
+    def nodes(self):
+        return self.expanded[MAX_PLAYER] + self.expanded[CHANCE_PLAYER] + self.leaves
+
+    @property
+    def total_time(self):
+        return self.build_time + self.eval_time
+
+    @property
+    def nodes_per_sec(self):
+        return self.nodes / self.total_time if self.total_time > 0 else 0.0
+
+    @property
+    def branching_factor(self):
+        return effective_branching_factor(self.nodes, self.search_depth)
+
+    @property
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
+
+    def as_dict(self):
+        return {
+            'search_depth': self.search_depth,
+            'max_nodes': self.expanded[MAX_PLAYER],
+            'chance_nodes': self.expanded[CHANCE_PLAYER],
+            'leaves': self.leaves,
+            'nodes': self.nodes,
+            'reused_nodes': self.reused_nodes,
+            'peak_nodes': self.peak_nodes,
+            'build_time': self.build_time,
+            'eval_time': self.eval_time,
+            'nodes_per_sec': self.nodes_per_sec,
+            'branching_factor': self.branching_factor,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'pruned_nodes': self.pruned_nodes,
+        }
+
+    def __str__(self):
+        return ("depth {} | nodes {} (max {}, chance {}, leaves {}, reused {}) | peak {} | "
+                "build {:.1f} ms, eval {:.1f} ms | {:.0f} nodes/s | b* {:.2f} | cache hits {:.0%}").format(
+                    self.search_depth, self.nodes, self.expanded[MAX_PLAYER], self.expanded[CHANCE_PLAYER],
+                    self.leaves, self.reused_nodes, self.peak_nodes, self.build_time * 1000, self.eval_time * 1000,
+                    self.nodes_per_sec, self.branching_factor, self.cache_hit_rate)
+
+
+class SearchStats:
+    def __init__(self, window=100):
+        self.records = deque(maxlen=window)
+        self.current = None
+        self.decisions = 0
+        self._cache_start = (0, 0)
+        self._pruned_start = 0
+        # set while a timed() call is running, so that the search functions
+        # only time their outermost call
+        self.timing = False
+
+    # opens the record of a new decision of ai unless one is already open
+    def begin(self, ai):
+        if self.current is None:
+            self.current = DecisionRecord(ai.search_depth)
+            self._cache_start = (ai.cache.hits, ai.cache.misses)
+            self._pruned_start = ai.pruned_nodes
+        return self.current
+
+    # closes the current decision record and returns it
+    def end(self, ai):
+        record = self.current
+        if record is None:
+            return None
+        record.cache_hits = ai.cache.hits - self._cache_start[0]
+        record.cache_misses = ai.cache.misses - self._cache_start[1]
+        record.pruned_nodes = ai.pruned_nodes - self._pruned_start
+        if record.tree_nodes:
+            # every node of a built tree, root included, is alive at once
+            record.peak_nodes = max(record.peak_nodes, record.tree_nodes + 1)
+        self.records.append(record)
+        self.decisions += 1
+        self.current = None
+        return record
+
+    # runs search() as the 'build' or 'eval' phase of the current decision of
+    # ai and adds its wall time; the end of an 'eval' phase closes the record
+    def timed(self, ai, phase, search):
+        record = self.begin(ai)
+        self.timing = True
+        start = time.time()
+        try:
+            return search()
+        finally:
+            self.timing = False
+            if phase == 'build':
+                record.build_time += time.time() - start
+            else:
+                record.eval_time += time.time() - start
+                self.end(ai)
+
+    @property
+    def last(self):
+        return self.records[-1] if self.records else None
+
+    # averages of every numeric field over the rolling window
+    def rolling(self):
+        if not self.records:
+            return {}
+        dicts = [record.as_dict() for record in self.records]
+        return dict((key, sum(d[key] for d in dicts) / len(dicts)) for key in dicts[0])
+
+    def summary(self):
+        avg = self.rolling()
+        if not avg:
+            return "no decisions recorded"
+        return ("last {} of {} decisions: {:.0f} nodes, {:.1f} ms, {:.0f} nodes/s, "
+                "b* {:.2f}, peak {:.0f} nodes, cache hits {:.0f}/{:.0f}").format(
+                    len(self.records), self.decisions, avg['nodes'],
+                    (avg['build_time'] + avg['eval_time']) * 1000, avg['nodes_per_sec'],
+                    avg['branching_factor'], avg['peak_nodes'], avg['cache_hits'],
+                    avg['cache_hits'] + avg['cache_misses'])
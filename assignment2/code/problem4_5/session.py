@@ -0,0 +1,109 @@
+from __future__ import absolute_import, division, print_function
+from ai import AI, MAX_PLAYER, NO_MOVE_SCORE
+from transposition import TranspositionTable
+
+# Persistent AI for playing a whole game. Instead of building a fresh AI and
+# tree for every move, the session keeps the tree of its last decision. After
+# the move is played and a tile spawns, the subtree below the matching
+# grandchild (CHANCE child of the played direction, then the MAX child for
+# the spawned tile) becomes the new root and only its frontier is expanded
+# (one MAX/CHANCE move-and-place round) to get back to the full search depth.
+# The transposition table is kept across moves too.
+#
+# With stats, a decision that reuses the tree is recorded like a fresh one:
+# build_time covers moving the root and extending the frontier, the node
+# counts cover the whole retained tree, and DecisionRecord.reused_nodes tells
+# how many of its nodes were carried over from the previous decision.
+#
+# Usage:
+#     session = AISession(search_depth=3)
+#     direction = session.compute_decision(game.get_state())
+#     game.move_and_place(direction)
+class AISession:
+    def __init__(self, search_depth=3, ec=False, cache=None, stats=None):
+        self.search_depth = search_depth
+        self.ec = ec
+        self.stats = stats
+        self.cache = cache if cache is not None else TranspositionTable()
+        self.ai = None
+        self.last_direction = None
+
+        # number of decisions that reused / rebuilt the tree
+        self.reused = 0
+        self.rebuilt = 0
+
+    def reset(self):
+        self.ai = None
+        self.last_direction = None
+
+    def compute_decision(self, state):
+        if self.stats is not None and self.ai is not None:
+            reused = self.stats.timed(self.ai, 'build', lambda: self.advance(state))
+        else:
+            reused = self.advance(state)
+        if not reused:
+            self.ai = AI(state, self.search_depth, cache=self.cache, stats=self.stats)
+            self.ai.build_tree()
+            self.rebuilt += 1
+        else:
+            self.reused += 1
+            if self.stats is not None:
+                self.count_tree(self.stats.begin(self.ai))
+
+        if self.ec:
+            direction, _ = self.ai.custom_expectimax(self.ai.root)
+        else:
+            direction, _ = self.ai.expectimax(self.ai.root)
+        self.last_direction = direction
+        return direction
+
+    # moves the root to the grandchild matching state and extends its
+    # subtree to the search depth; returns False if the tree cannot be reused
+    def advance(self, state):
+        if self.ai is None or self.search_depth < 2:
+            return False
+        tile_matrix, score = state
+        root = self.ai.root
+        if root.state[0] == tile_matrix and root.state[1] == score:
+            return True
+
+        for direction, chance_node in root.children:
+            if direction != self.last_direction:
+                continue
+            for _, max_node in chance_node.children:
+                if max_node.state[0] == tile_matrix and max_node.state[1] == score:
+                    self.ai.root = max_node
+                    self.extend(max_node)
+                    return True
+        return False
+
+    # counts every node of the current tree into record, as build_tree does
+    # for a fresh tree, and the nodes that existed before this decision's
+    # extend into record.reused_nodes
+    def count_tree(self, record):
+        new_nodes = record.tree_nodes
+        record.expanded = [0, 0]
+        record.tree_nodes = 0
+        stack = [self.ai.root]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                record.expanded[node.player_type] += 1
+                record.tree_nodes += len(node.children)
+                stack.extend(child for _, child in node.children)
+        record.reused_nodes = record.tree_nodes - new_nodes
+
+    # expands the nodes two plies above the search depth, which were the
+    # leaves of the previous tree
+    def extend(self, node, depth=0):
+        frontier_depth = self.search_depth - 2
+        if depth == frontier_depth:
+            # no-op children of MAX nodes are real leaves, not frontier
+            if node.is_terminal() and node.state[1] != NO_MOVE_SCORE:
+                if node.player_type != MAX_PLAYER:
+                    # CHANCE expansion reads open tiles from the simulator
+                    self.ai.simulator.reset(*node.state)
+                self.ai.build_tree(node, depth)
+            return
+        for _, child in node.children:
+            self.extend(child, depth + 1)
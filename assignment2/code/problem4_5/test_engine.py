@@ -0,0 +1,307 @@
+from __future__ import absolute_import, division, print_function
+import random, sys
+
+from game import Game
+import bitboard
+from bitboard import BitboardGame, MIN_BOARD_SIZE, MAX_BOARD_SIZE
+import heuristic
+from ai import AI
+from session import AISession
+from search_stats import SearchStats
+from benchmark import load_test_states
+
+# Self-checks of the packed-board engine against the reference Game, of the
+# table-driven heuristic against custom_evaluation, and of the search
+# variants of AI against build_tree + expectimax / custom_expectimax:
+#
+#     python test_engine.py
+#
+# Run it after any change to bitboard.py, move_tables.py, game.py,
+# heuristic.py or ai.py.
+
+# 4x4 board with two pairs of 32768 tiles, whose merges pass a 4-bit cell
+OVERFLOW_BOARD = [[32768, 32768, 4, 2], [2, 4, 32768, 32768], [8, 2, 4, 8], [2, 4, 8, 2]]
+
+NUM_GAMES = 20
+MAX_MOVES = 300
+NUM_BOARDS = 2000
+# boards per size and depths of the search checks
+SEARCH_SIZES = [3, 4, 5, 6]
+SEARCH_STATES = 3
+SEARCH_DEPTHS = [2, 3, 4]
+# probability cutoffs of the search path check (0 disables pruning)
+PATH_CUTOFFS = [0.0, 0.15]
+# moves per depth of the session check
+SESSION_MOVES = 20
+
+def print_check(passed, item):
+    if passed:
+        print("PASSED: {}.".format(item))
+    else:
+        print("FAILED: {}.".format(item))
+    return passed
+
+# plays the same seeded game with Game and BitboardGame on an empty size x
+# size board (Game() itself for 4x4) and returns the first move at which
+# they differ, or None
+def compare_games(size, seed, max_moves=MAX_MOVES):
+    chooser = random.Random(seed)
+    random.seed(seed)
+    if size == 4:
+        game = Game(undo_depth=0)
+    else:
+        game = Game([[0] * size for _ in range(size)], undo_depth=0)
+        game.place_random_tile()
+        game.place_random_tile()
+    random.seed(seed)
+    if size == 4:
+        bit_game = BitboardGame()
+    else:
+        bit_game = BitboardGame([[0] * size for _ in range(size)])
+        bit_game.place_random_tile()
+        bit_game.place_random_tile()
+
+    for moves in range(max_moves):
+        if (game.tile_matrix != bit_game.tile_matrix or game.score != bit_game.score or
+                game.get_open_tiles() != bit_game.get_open_tiles() or game.game_over() != bit_game.game_over()):
+            return moves
+        if game.game_over():
+            return None
+        direction = chooser.randint(0, 3)
+        state = random.getstate()
+        game.move_and_place(direction)
+        random.setstate(state)
+        bit_game.move_and_place(direction)
+    return None
+
+def test_engine(num_games=NUM_GAMES):
+    passed = True
+    for size in range(MIN_BOARD_SIZE, MAX_BOARD_SIZE + 1):
+        failures = []
+        for seed in range(num_games):
+            move = compare_games(size, seed)
+            if move is not None:
+                failures.append((seed, move))
+        item = "BitboardGame matches Game on {0}x{0} boards ({1} seeded games)".format(size, num_games)
+        if failures:
+            item += ", first mismatch in game {} at move {}".format(*failures[0])
+        passed = print_check(not failures, item) and passed
+    return passed
+
+# merges of two 32768 tiles on a 4x4 board: the module-level bitboard.move
+# must refuse them, while BitboardGame (switching to 8-bit cells) and the
+# evaluation must keep matching Game
+def test_overflow():
+    board = bitboard.to_board(OVERFLOW_BOARD)
+    try:
+        bitboard.move(board, 0)
+        raised = False
+    except OverflowError:
+        raised = True
+    passed = print_check(raised, "bitboard.move raises OverflowError for a 32768 + 32768 merge")
+
+    game = Game(OVERFLOW_BOARD, undo_depth=0)
+    bit_game = BitboardGame()
+    # a 4-bit board, as if the game had grown there, so the first merge widens it
+    bit_game.board = board
+    matches = True
+    for direction in (0, 2, 1, 3, 0):
+        game.move(direction)
+        bit_game.move(direction)
+        matches = (matches and game.tile_matrix == bit_game.tile_matrix and game.score == bit_game.score and
+                   heuristic.evaluate_state(*game.get_state()) == heuristic.custom_evaluation(*game.get_state()))
+    passed = print_check(matches and bit_game.engine.cell_bits == 8,
+                         "BitboardGame and evaluate_state match Game past 32768") and passed
+    return passed
+
+# random size x size (tile_matrix, score) states; tiles stay below 2^15,
+# the largest value a 4-bit cell holds
+def random_states(size, num_boards, rng):
+    tiles = [0] * 6 + [1 << rank for rank in range(1, 15)]
+    return [([[rng.choice(tiles) for _ in range(size)] for _ in range(size)], rng.randint(0, 100000))
+            for _ in range(num_boards)]
+
+# compares heuristic.evaluate_state with custom_evaluation on random boards
+# of every supported size, with the current weights and with every weight
+# set to a distinct nonzero value (so that no feature of the tables goes
+# unchecked); the weights are restored afterwards
+def test_evaluation(num_boards=NUM_BOARDS):
+    rng = random.Random(0)
+    weights = heuristic.current_weights()
+    weight_sets = [('current weights', weights), ('all weights nonzero', nonzero_weights())]
+    passed = True
+    try:
+        for label, weight_set in weight_sets:
+            heuristic.set_weights(weight_set)
+            for size in range(MIN_BOARD_SIZE, MAX_BOARD_SIZE + 1):
+                mismatches = sum(1 for state in random_states(size, num_boards, rng)
+                                 if heuristic.evaluate_state(*state) != heuristic.custom_evaluation(*state))
+                passed = print_check(not mismatches,
+                                     "evaluate_state matches custom_evaluation on {0}x{0} boards, {1} "
+                                     "({2} boards, {3} mismatches)".format(size, label, num_boards, mismatches)) and passed
+    finally:
+        heuristic.set_weights(weights)
+    return passed
+
+# num_states states of seeded random-move games on size x size boards,
+# taken after a few moves so that the boards have both tiles and gaps
+def search_states(size, num_states=SEARCH_STATES, seed=0):
+    if size == 4:
+        return load_test_states()[:num_states]
+    state = random.getstate()
+    states = []
+    for k in range(num_states):
+        random.seed(seed + k)
+        chooser = random.Random(seed + k)
+        game = Game([[0] * size for _ in range(size)], undo_depth=0)
+        game.place_random_tile()
+        game.place_random_tile()
+        for _ in range(size * size // 2 + 5 * k):
+            if game.game_over():
+                break
+            game.move_and_place(chooser.randint(0, 3))
+        states.append(([row[:] for row in game.tile_matrix], game.score))
+    random.setstate(state)
+    return states
+
+# (direction, value) of the root by build_tree + expectimax, or
+# custom_expectimax if ec is set
+def tree_decision(state, depth, ec=False):
+    ai = AI(state, depth)
+    ai.build_tree()
+    return ai.custom_expectimax(ai.root) if ec else ai.expectimax(ai.root)
+
+# (direction, value) of the root by every search path of AI that does not
+# need a process pool, as {name: result}
+def path_decisions(state, depth, ec, prob_cutoff):
+    results = {}
+    ai = AI(state, depth, prob_cutoff=prob_cutoff)
+    ai.build_tree()
+    results['tree'] = ai.custom_expectimax(ai.root) if ec else ai.expectimax(ai.root)
+    if ec:
+        ai = AI(state, depth, prob_cutoff=prob_cutoff)
+        ai.build_tree()
+        results['batched'] = ai.custom_expectimax_batched(ai.root)
+    results['stream'] = AI(state, depth, prob_cutoff=prob_cutoff).stream_expectimax(ec=ec)
+    ai = AI(state, depth, prob_cutoff=prob_cutoff)
+    ai.build_compact_tree()
+    results['compact'] = ai.compact_expectimax(ai.compact_root, 0, ec)
+    return results
+
+# compares the tree, batched (ec only), stream and compact searches on the
+# test_states boards, with and without the probability cutoff
+def test_paths(depths=(2, 3), cutoffs=PATH_CUTOFFS):
+    passed = True
+    states = load_test_states()
+    for prob_cutoff in cutoffs:
+        for ec in (False, True):
+            mismatches = []
+            for state in states:
+                for depth in depths:
+                    results = path_decisions(state, depth, ec, prob_cutoff)
+                    mismatches += [name for name, result in results.items() if result != results['tree']]
+            item = "all search paths agree, {}prob_cutoff {} ({} boards, depths {})".format(
+                'ec, ' if ec else '', prob_cutoff, len(states), ', '.join(map(str, depths)))
+            if mismatches:
+                item += ", mismatches in {}".format(', '.join(sorted(set(mismatches))))
+            passed = print_check(not mismatches, item) and passed
+    return passed
+
+# compares stream_expectimax, with and without its transposition table, with
+# tree_decision on boards of several sizes and search depths
+def test_stream(sizes=SEARCH_SIZES, depths=SEARCH_DEPTHS):
+    passed = True
+    for size in sizes:
+        states = search_states(size)
+        for depth in depths:
+            mismatches = 0
+            for state in states:
+                for ec in (False, True):
+                    expected = tree_decision(state, depth, ec)
+                    for cache in (True, False):
+                        ai = AI(state, depth)
+                        ai.stream_cache = cache
+                        if ai.stream_expectimax(ec=ec) != expected:
+                            mismatches += 1
+            passed = print_check(not mismatches,
+                                 "stream_expectimax matches the tree search on {0}x{0} boards at depth {1} "
+                                 "({2} boards, {3} mismatches)".format(size, depth, len(states), mismatches)) and passed
+    return passed
+
+# weights of the evaluation checks that change the heuristic the most:
+# every weight set, to a distinct nonzero value
+def nonzero_weights():
+    return dict((name, k + 2) for k, name in enumerate(heuristic.WEIGHT_NAMES))
+
+# compares compute_decision_parallel, with and without split_chance, with
+# compute_decision_stream on the test_states boards, first with the current
+# heuristic weights and then with weights changed after the worker pool has
+# started (the workers must pick them up); the weights are restored afterwards
+def test_parallel(depths=(2, 3), max_workers=2):
+    import parallel_search
+    states = load_test_states() + search_states(4, seed=100)
+    weights = heuristic.current_weights()
+    passed = True
+    try:
+        for label, weight_set in (('current weights', weights), ('weights changed at runtime', nonzero_weights())):
+            heuristic.set_weights(weight_set)
+            mismatches = 0
+            checks = 0
+            for state in states:
+                for depth in depths:
+                    for ec in (False, True):
+                        expected = AI(state, depth).compute_decision_stream(ec=ec)
+                        for split_chance in (False, True):
+                            checks += 1
+                            if AI(state, depth).compute_decision_parallel(ec, split_chance, max_workers) != expected:
+                                mismatches += 1
+            passed = print_check(not mismatches,
+                                 "compute_decision_parallel matches compute_decision_stream, {} "
+                                 "({} decisions, {} mismatches)".format(label, checks, mismatches)) and passed
+    finally:
+        heuristic.set_weights(weights)
+        parallel_search.shutdown_pool()
+    return passed
+
+# plays a seeded game with AISession decisions and compares every decision
+# with a fresh AI's, for each depth and both evaluations; the session must
+# also have reused its tree, and its stats must count the whole tree
+def test_session(depths=SEARCH_DEPTHS, num_moves=SESSION_MOVES, seed=0):
+    passed = True
+    state = random.getstate()
+    for depth in depths:
+        for ec in (False, True):
+            random.seed(seed)
+            game = Game(undo_depth=0)
+            stats = SearchStats()
+            session = AISession(depth, ec=ec, stats=stats)
+            mismatches = 0
+            miscounted = 0
+            moves = 0
+            while moves < num_moves and not game.game_over():
+                direction = session.compute_decision(game.get_state())
+                fresh_stats = SearchStats()
+                fresh = AI(game.get_state(), depth, stats=fresh_stats)
+                if direction != (fresh.compute_decision_ec() if ec else fresh.compute_decision()):
+                    mismatches += 1
+                if stats.last.tree_nodes != fresh_stats.last.tree_nodes:
+                    miscounted += 1
+                game.move_and_place(direction)
+                moves += 1
+            item = ("AISession matches fresh AI decisions at depth {}{} ({} moves, {} reused trees, {} mismatches, "
+                    "{} tree counts off)".format(depth, ', ec' if ec else '', moves, session.reused, mismatches,
+                                                 miscounted))
+            passed = print_check(not mismatches and not miscounted and (depth < 2 or session.reused > 0),
+                                 item) and passed
+    random.setstate(state)
+    return passed
+
+if __name__ == '__main__':
+    passed = test_engine()
+    passed = test_overflow() and passed
+    passed = test_evaluation() and passed
+    passed = test_stream() and passed
+    passed = test_paths() and passed
+    passed = test_parallel() and passed
+    passed = test_session() and passed
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,154 @@
+from __future__ import absolute_import, division, print_function
+import argparse, csv, json, random, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from game import Game
+from ai import AI
+from search_stats import SearchStats
+import heuristic
+
+# Headless batch runner: plays N seeded games for each AI configuration on a
+# process pool and streams one result per finished game to a JSONL or CSV
+# file. No pygame or display needed.
+#
+#     python tournament.py --games 1000 --config expectimax:3 --config ec:2 \
+#         --output results.jsonl
+#
+# A configuration can override heuristic weights (see heuristic.WEIGHT_NAMES)
+# after the depth, to compare weight sets of the custom evaluation:
+#
+#     python tournament.py --config ec:2 --config ec:2:OPEN_TILE_WEIGHT=900:POT_MERGE_WEIGHT=400
+
+# decision methods selectable in a configuration "<method>:<depth>[:<NAME>=<value>...]"
+DECISIONS = {
+    'expectimax': 'compute_decision',
+    'ec': 'compute_decision_ec',
+    # the depth is ignored; rollouts use their default count and horizon
+    'rollout': 'compute_decision_rollout',
+}
+
+FIELDS = ['config', 'seed', 'score', 'best_tile', 'moves', 'wall_time', 'nodes', 'stalled']
+
+# returns (method, depth, {weight name: value}) of a configuration
+def parse_config(text):
+    parts = text.split(':')
+    method = parts[0]
+    if method not in DECISIONS:
+        raise argparse.ArgumentTypeError(
+            "unknown method '{}' (choose from {})".format(method, ', '.join(sorted(DECISIONS))))
+    try:
+        depth = int(parts[1]) if len(parts) > 1 and parts[1] else 3
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid depth in '{}'".format(text))
+    weights = {}
+    for override in parts[2:]:
+        name, _, value = override.partition('=')
+        if name not in heuristic.WEIGHT_NAMES:
+            raise argparse.ArgumentTypeError(
+                "unknown weight '{}' in '{}' (choose from {})".format(name, text, ', '.join(heuristic.WEIGHT_NAMES)))
+        try:
+            weights[name] = int(value)
+        except ValueError:
+            try:
+                weights[name] = float(value)
+            except ValueError:
+                raise argparse.ArgumentTypeError("invalid value for {} in '{}'".format(name, text))
+    return method, depth, weights
+
+# sets the heuristic weights to their defaults with the given overrides,
+# rebuilding the heuristic tables if anything changed. Worker processes play
+# games of several configurations, so every game sets all the weights.
+def apply_weights(weights):
+    values = dict(heuristic.DEFAULT_WEIGHTS)
+    values.update(weights)
+    heuristic.set_weights(values)
+
+# plays one game to the end (or max_moves) and returns its result record
+def play_game(config, seed, max_moves=None):
+    method, depth, weights = parse_config(config)
+    apply_weights(weights)
+    random.seed(seed)
+    game = Game(undo_depth=0)
+    moves = 0
+    nodes = 0
+    stalled = False
+    stats = SearchStats()
+    start = time.time()
+    while not game.game_over():
+        if max_moves is not None and moves >= max_moves:
+            break
+        ai = AI(game.get_state(), depth, stats=stats)
+        direction = getattr(ai, DECISIONS[method])()
+        nodes += stats.last.nodes
+        before = [row[:] for row in game.tile_matrix]
+        game.move_and_place(direction)
+        moves += 1
+        # the search is deterministic, so a no-op decision repeats forever
+        if game.tile_matrix == before:
+            stalled = True
+            break
+    best_tile = max(max(row) for row in game.tile_matrix)
+    return {
+        'config': config,
+        'seed': seed,
+        'score': game.score,
+        'best_tile': best_tile,
+        'moves': moves,
+        'wall_time': time.time() - start,
+        'nodes': nodes,
+        'stalled': stalled,
+    }
+
+class ResultWriter:
+    def __init__(self, f, fmt):
+        self.f = f
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(f, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def write(self, record):
+        if self.fmt == 'csv':
+            self.writer.writerow(record)
+        else:
+            self.f.write(json.dumps(record) + '\n')
+        self.f.flush()
+
+def run_tournament(configs, games, first_seed, out, fmt='jsonl', workers=None, max_moves=None):
+    writer = ResultWriter(out, fmt)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play_game, config, seed, max_moves)
+                   for config in configs
+                   for seed in range(first_seed, first_seed + games)]
+        for future in as_completed(futures):
+            writer.write(future.result())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless 2048 AI tournament.')
+    parser.add_argument('--config', '-c', action='append', dest='configs',
+                        help='AI configuration <method>:<depth>[:<WEIGHT>=<value>...], methods: {} '
+                             '(repeatable, default expectimax:3)'.format(
+                            ', '.join(sorted(DECISIONS))))
+    parser.add_argument('--games', '-n', type=int, default=10, help='games per configuration')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--max-moves', type=int, default=None, help='stop each game after this many moves')
+    parser.add_argument('--output', '-o', default='-', help='output file (.csv for CSV, JSONL otherwise; - for stdout)')
+    args = parser.parse_args(argv)
+
+    configs = args.configs or ['expectimax:3']
+    for config in configs:
+        try:
+            parse_config(config)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+
+    fmt = 'csv' if args.output.endswith('.csv') else 'jsonl'
+    if args.output == '-':
+        run_tournament(configs, args.games, args.seed, sys.stdout, fmt, args.workers, args.max_moves)
+    else:
+        with open(args.output, 'w', newline='') as out:
+            run_tournament(configs, args.games, args.seed, out, fmt, args.workers, args.max_moves)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, print_function
+from collections import OrderedDict
+
+DEFAULT_CAPACITY = 1 << 17
+
+# Bounded transposition table with LRU eviction. Maps a search position key to
+# the (direction, value) tuple expectimax computed for it, and counts hits and
+# misses so that the benefit of caching can be measured.
+class TranspositionTable:
+    def __init__(self, capacity = DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive, got {}".format(capacity))
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # returns the cached entry for key (marking it as recently used),
+    # or None on a miss
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
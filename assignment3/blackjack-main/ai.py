@@ -2,8 +2,10 @@ import copy
 import random
 import math
 import matplotlib.pyplot as plt
+import numpy as np
 
 from game import Game, states
+from state_tables import StateTable, STATE_INDEX
 
 HIT = 0
 STAND = 1
@@ -12,29 +14,23 @@ DISCOUNT = 0.95 #This is the gamma value for all value calculations
 class Agent:
     def __init__(self):
 
+        # All tables are StateTables (see state_tables.py): dict-like views
+        # keyed by state over NumPy arrays in `table.values`, zero-initialized
+
         # For MC values
-        self.MC_values = {} # Dictionary: Store the MC value of each state
-        self.S_MC = {}      # Dictionary: Store the sum of returns in each state
-        self.N_MC = {}      # Dictionary: Store the number of samples of each state
+        self.MC_values = StateTable()           # Store the MC value of each state
+        self.S_MC = StateTable()                # Store the sum of returns in each state
+        self.N_MC = StateTable(dtype=np.int64)  # Store the number of samples of each state
         # MC_values should be equal to S_MC divided by N_MC on each state (important for passing tests)
 
         # For TD values
-        self.TD_values = {}  # Dictionary storing the TD value of each state
-        self.N_TD = {}       # Dictionary: Store the number of samples of each state
+        self.TD_values = StateTable()           # Store the TD value of each state
+        self.N_TD = StateTable(dtype=np.int64)  # Store the number of samples of each state
 
         # For Q-learning values
-        self.Q_values = {}   # Dictionary storing the Q-Learning value of each state and action
-        self.N_Q = {}        # Dictionary: Store the number of samples of each state
-
-        # Initialization of the values
-        for s in states:
-            self.MC_values[s] = 0
-            self.S_MC[s] = 0
-            self.N_MC[s] = 0
-            self.TD_values[s] = 0
-            self.N_TD[s] = 0
-            self.Q_values[s] = [0,0] # First element is the Q value of "Hit", second element is the Q value of "Stand"
-            self.N_Q[s] = 0
+        # First element is the Q value of "Hit", second element is the Q value of "Stand"
+        self.Q_values = StateTable(width=2)     # Store the Q-Learning value of each state and action
+        self.N_Q = StateTable(dtype=np.int64)   # Store the number of samples of each state
         # NOTE: see the comment of `init_cards()` method in `game.py` for description of game state       
         self.simulator = Game()
 
@@ -64,6 +60,12 @@ class Agent:
         N_vec_A = []
         N_vec_B = []
 
+        # the learning loops update Python lists indexed by STATE_INDEX
+        # positions, which are much cheaper to update one entry at a time
+        # than the NumPy arrays of the tables, and write them back at the end
+        S = self.S_MC.values.tolist()
+        N = self.N_MC.values.tolist()
+
         # Perform num_simulation rounds of simulations in each cycle of the overall game loop
         for simulation in range(num_simulation):
             # Do not modify the following three lines
@@ -81,25 +83,19 @@ class Agent:
 
             episode = self.simulator.simulate_sequence(self.default_policy)
             # print(episode)
-            len_episode = len(episode)
-
-            for i in range(len_episode):
-                s, r = episode[i]
-                self.N_MC[s] += 1
-                for j in range(i, len_episode):
-                    self.S_MC[s] = self.S_MC[s] + pow(DISCOUNT, j-i) * episode[j][1]
 
+            # a state occurs at most once per episode (the user's sum only
+            # grows), so its value after the episode is its value at the visit
+            for (s, r), i in zip(episode, self.MC_add_episode(S, N, episode)):
                 if (s == state_A):
-                    MC_vec_A.append(self.S_MC[s] / self.N_MC[s])
-                    N_vec_A.append(self.N_MC[s])
+                    MC_vec_A.append(S[i] / N[i])
+                    N_vec_A.append(N[i])
                 elif (s == state_B):
-                    MC_vec_B.append(self.S_MC[s] / self.N_MC[s])
-                    N_vec_B.append(self.N_MC[s])
+                    MC_vec_B.append(S[i] / N[i])
+                    N_vec_B.append(N[i])
 
         # after all the simulations, take the average
-        for s in states:
-            if self.N_MC[s] > 0:
-                self.MC_values[s] = self.S_MC[s] / self.N_MC[s]
+        self.MC_store(S, N)
 
         # PLOTTING CODE
         fig = plt.figure()
@@ -121,6 +117,65 @@ class Agent:
         # fig.savefig("plots/MC_value_vs_visit_state_B.png")
 
     
+    # discounted return of every step of an episode [(state, reward), ...],
+    # computed in one backward pass: G_t = r_t + DISCOUNT * G_{t+1}
+    @staticmethod
+    def episode_returns(episode):
+        returns = [0] * len(episode)
+        G = 0
+        for t in range(len(episode) - 1, -1, -1):
+            G = episode[t][1] + DISCOUNT * G
+            returns[t] = G
+        return returns
+
+    # writes the sums of returns S and visit counts N (lists over
+    # game.states) to S_MC and N_MC and sets MC_values to S / N on every
+    # visited state
+    def MC_store(self, S, N):
+        self.S_MC.values[:] = S
+        self.N_MC.values[:] = N
+        visited = self.N_MC.values > 0
+        self.MC_values.values[visited] = self.S_MC.values[visited] / self.N_MC.values[visited]
+
+    # the MC update of one episode on the list copies S and N of S_MC and
+    # N_MC; returns the STATE_INDEX positions of its states
+    def MC_add_episode(self, S, N, episode):
+        index = [STATE_INDEX[s] for s, _ in episode]
+        for i, G in zip(index, self.episode_returns(episode)):
+            N[i] += 1
+            S[i] += G
+        return index
+
+    # MC update of a list of episodes, then refreshes MC_values
+    def MC_update(self, episodes):
+        S = self.S_MC.values.tolist()
+        N = self.N_MC.values.tolist()
+        for episode in episodes:
+            self.MC_add_episode(S, N, episode)
+        self.MC_store(S, N)
+
+    # MC_run without the plots and per-visit traces
+    def MC_train(self, num_simulation):
+        S = self.S_MC.values.tolist()
+        N = self.N_MC.values.tolist()
+        for simulation in range(num_simulation):
+            self.simulator.reset()
+            self.MC_add_episode(S, N, self.simulator.simulate_sequence(self.default_policy))
+        self.MC_store(S, N)
+
+    # MC_train on the vectorized simulator of batch_game.py: plays
+    # num_simulation episodes in NumPy batches and adds their sums to S_MC
+    # and N_MC
+    def MC_batch_run(self, num_simulation, seed=None):
+        from batch_game import mc_statistics
+        S, N = mc_statistics(num_simulation, DISCOUNT, seed=seed)
+        self.MC_add_statistics(S, N)
+
+    # adds per-state sums of returns and visit counts (arrays over
+    # game.states) to S_MC and N_MC and refreshes MC_values
+    def MC_add_statistics(self, S, N):
+        self.MC_store(self.S_MC.values + S, self.N_MC.values + N)
+
     def TD_run(self, num_simulation, tester=False):
         state_A = (10,0,1)
         state_B = (20,0,1)
@@ -129,6 +184,10 @@ class Agent:
         TD_vec_B = []
         N_vec_B = []
 
+        # list copies of the tables, see MC_run
+        V = self.TD_values.values.tolist()
+        N = self.N_TD.values.tolist()
+
         # Perform num_simulation rounds of simulations in each cycle of the overall game loop
         for simulation in range(num_simulation):
             # Do not modify the following three lines
@@ -147,26 +206,20 @@ class Agent:
             s = self.simulator.state
 
             while s is not None:
-                action = self.default_policy(s)
-                
-                R = self.simulator.check_reward()
-                next_s, _ = self.simulator.simulate_one_step(action)
-
-                if next_s is None:
-                    self.TD_values[next_s] = 0
-
-                self.N_TD[s] += 1
-                self.TD_values[s] = self.TD_values[s] + self.alpha(self.N_TD[s]) * (R + DISCOUNT * self.TD_values[next_s] - self.TD_values[s])
+                i, next_s = self.TD_step(V, N, s)
 
                 if (s == state_A):
-                    TD_vec_A.append(self.TD_values[s])
-                    N_vec_A.append(self.N_TD[s])
+                    TD_vec_A.append(V[i])
+                    N_vec_A.append(N[i])
                 elif (s == state_B):
-                    TD_vec_B.append(self.TD_values[s])
-                    N_vec_B.append(self.N_TD[s])
+                    TD_vec_B.append(V[i])
+                    N_vec_B.append(N[i])
 
                 s = next_s
 
+        self.TD_values.values[:] = V
+        self.N_TD.values[:] = N
+
         # PLOTTING CODE
         fig = plt.figure()
         plt.plot(N_vec_A, TD_vec_A)
@@ -186,7 +239,71 @@ class Agent:
         plt.show()
         # fig.savefig("plots/TD_value_vs_visit_state_B.png")
 
-                
+    # plays one default_policy step from the simulator's state s and applies
+    # the TD update to the list copies V and N of TD_values and N_TD;
+    # returns (STATE_INDEX position of s, next state)
+    def TD_step(self, V, N, s):
+        i = STATE_INDEX[s]
+        action = self.default_policy(s)
+
+        R = self.simulator.check_reward()
+        next_s, _ = self.simulator.simulate_one_step(action)
+
+        # the episode ends after a terminal state, worth 0 from then on
+        next_value = V[STATE_INDEX[next_s]] if next_s is not None else 0
+
+        N[i] += 1
+        V[i] = V[i] + self.alpha(N[i]) * (R + DISCOUNT * next_value - V[i])
+        return i, next_s
+
+    # TD_run without the plots and per-visit traces
+    def TD_train(self, num_simulation):
+        V = self.TD_values.values.tolist()
+        N = self.N_TD.values.tolist()
+        for simulation in range(num_simulation):
+            self.simulator.reset()
+            s = self.simulator.state
+            while s is not None:
+                _, s = self.TD_step(V, N, s)
+        self.TD_values.values[:] = V
+        self.N_TD.values[:] = N
+
+    # plays one epsilon-greedy step from the simulator's state s and applies
+    # the Q-learning update to the list copies Q and N of Q_values and N_Q;
+    # if given, A[i][action] counts the updates of each (state, action) pair.
+    # Returns (STATE_INDEX position of s, next state)
+    def Q_step(self, Q, N, s, epsilon, A=None):
+        i = STATE_INDEX[s]
+        # pick_action on the list copy of Q_values
+        action = self.epsilon_greedy(Q[i], epsilon)
+        R = self.simulator.check_reward()
+
+        next_s, _ = self.simulator.simulate_one_step(action)
+
+        # the episode ends after a terminal state, worth 0 from then on
+        next_value = max(Q[STATE_INDEX[next_s]]) if next_s is not None else 0
+
+        N[i] += 1
+        if A is not None:
+            A[i][action] += 1
+        Q[i][action] = Q[i][action] + self.alpha(N[i]) * (R + DISCOUNT * next_value - Q[i][action])
+        return i, next_s
+
+    # Q_run without the plots and per-visit traces; returns the number of
+    # updates of each (state, action) pair as a [hit, stand] row per state
+    def Q_train(self, num_simulation, epsilon=0.4):
+        Q = self.Q_values.values.tolist()
+        N = self.N_Q.values.tolist()
+        A = [[0, 0] for _ in N]
+        for simulation in range(num_simulation):
+            self.simulator.reset()
+            s = self.simulator.state
+            while s is not None:
+                _, s = self.Q_step(Q, N, s, epsilon, A)
+        self.Q_values.values[:] = Q
+        self.N_Q.values[:] = N
+        return A
+
     def Q_run(self, num_simulation, tester=False):
         state_A = (10,0,1)
         state_B = (20,0,1)
@@ -198,6 +315,10 @@ class Agent:
         Q_vec_B_1 = []
         N_vec_B = []
 
+        # list copies of the tables, see MC_run; Q[i] is the [hit, stand] row
+        Q = self.Q_values.values.tolist()
+        N = self.N_Q.values.tolist()
+
         # Perform num_simulation rounds of simulations in each cycle of the overall game loop
         for simulation in range(num_simulation):
             # Do not modify the following three lines
@@ -219,28 +340,22 @@ class Agent:
             s = self.simulator.state
             
             while s is not None:
-                action = self.pick_action(s, epsilon)
-                R = self.simulator.check_reward()
-
-                next_s, _ = self.simulator.simulate_one_step(action)
-
-                if next_s is None:
-                    self.Q_values[next_s] = [0,0]
-
-                self.N_Q[s] += 1
-                self.Q_values[s][action] = self.Q_values[s][action] + self.alpha(self.N_Q[s]) * (R + DISCOUNT * max(self.Q_values[next_s][0], self.Q_values[next_s][1]) - self.Q_values[s][action])
+                i, next_s = self.Q_step(Q, N, s, epsilon)
 
                 if (s == state_A):
-                    Q_vec_A_0.append(self.Q_values[s][0])
-                    Q_vec_A_1.append(self.Q_values[s][1])
-                    N_vec_A.append(self.N_Q[s])
+                    Q_vec_A_0.append(Q[i][0])
+                    Q_vec_A_1.append(Q[i][1])
+                    N_vec_A.append(N[i])
                 elif (s == state_B):
-                    Q_vec_B_0.append(self.Q_values[s][0])
-                    Q_vec_B_1.append(self.Q_values[s][1])
-                    N_vec_B.append(self.N_Q[s])
+                    Q_vec_B_0.append(Q[i][0])
+                    Q_vec_B_1.append(Q[i][1])
+                    N_vec_B.append(N[i])
 
                 s = next_s
 
+        self.Q_values.values[:] = Q
+        self.N_Q.values[:] = N
+
         # PLOTTING CODE
         plt.gca().set_color_cycle(['red', 'blue'])
         fig = plt.figure()
@@ -268,10 +383,15 @@ class Agent:
 
     def pick_action(self, s, epsilon):
         # TODO: Replace the following random return value with the epsilon-greedy strategy
+        return self.epsilon_greedy(self.Q_values[s], epsilon)
+
+    # epsilon-greedy choice from a [hit, stand] row of Q values
+    @staticmethod
+    def epsilon_greedy(q, epsilon):
         if (random.random() < epsilon):
             return random.randint(0, 1)
         else:
-            if self.Q_values[s][0] > self.Q_values[s][1]:
+            if q[0] > q[1]:
                 return 0
             else:
                 return 1
@@ -0,0 +1,160 @@
+import numpy as np
+
+from game import HIT, STAND
+from state_tables import NUM_STATES
+
+'''
+    Vectorized version of Game: M hands are played in lockstep with NumPy.
+    Only the card values matter for learning, so cards are drawn as values
+    in bulk (rank 1..13 uniformly, jack/queen/king counting 10), which is the
+    same distribution as random.choice(cards) with replacement.
+
+    Every hand is described by the same numbers Game keeps (user and dealer
+    sums with aces counted as 1, number of aces, dealer's first card, stand
+    flag), and its state is reported as an index into game.states:
+    WIN_STATE = 0, LOSE_STATE = 1 and (user_sum, user_A_active, dealer_first)
+    at 2 + ((user_sum - 2) * 2 + user_A_active) * 10 + dealer_first - 1.
+'''
+
+WIN_INDEX = 0
+LOSE_INDEX = 1
+
+
+def state_index(user_sum, user_A_active, dealer_first):
+    return 2 + ((user_sum - 2) * 2 + user_A_active) * 10 + dealer_first - 1
+
+
+# card values of `size` cards drawn from an infinite deck
+def draw_values(rng, size):
+    return np.minimum(rng.integers(1, 14, size=size), 10)
+
+
+# vectorized Game.calculate_hand: (actual sums, ace-active flags)
+def calculate_hands(card_sum, card_A):
+    A_active = ((card_A > 0) & (card_sum + 10 <= 21)).astype(np.int64)
+    return card_sum + A_active * 10, A_active
+
+
+# vectorized Agent.default_policy on state indices of non-terminal states
+def default_policy(state):
+    user_sum = 2 + (state - 2) // 20
+    user_A_active = ((state - 2) // 10) % 2
+    return np.where(user_sum + user_A_active * 10 < 14, HIT, STAND)
+
+
+class BatchGame:
+    def __init__(self, num_hands, seed=None, rng=None):
+        self.num_hands = num_hands
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self.reset()
+
+    # deals new hands: user, dealer, user, dealer as Game.init_cards does
+    def reset(self):
+        cards = draw_values(self.rng, (4, self.num_hands))
+        self.user_sum = cards[0] + cards[2]
+        self.user_A = (cards[0] == 1).astype(np.int64) + (cards[2] == 1)
+        self.dealer_sum = cards[1] + cards[3]
+        self.dealer_A = (cards[1] == 1).astype(np.int64) + (cards[3] == 1)
+        self.dealer_first = cards[1]
+        self.stand = np.zeros(self.num_hands, dtype=bool)
+        self.state = self.make_state()
+
+    # vectorized Game.make_state, as state indices
+    def make_state(self):
+        actual_user_sum, user_A_active = calculate_hands(self.user_sum, self.user_A)
+        actual_dealer_sum, _ = calculate_hands(self.dealer_sum, self.dealer_A)
+
+        user_wins_stand = (actual_dealer_sum > 21) | (actual_user_sum > actual_dealer_sum)
+        open_sum = np.clip(self.user_sum, 2, 20)
+        state = np.where(self.stand,
+                         np.where(user_wins_stand, WIN_INDEX, LOSE_INDEX),
+                         state_index(open_sum, user_A_active, self.dealer_first))
+        state = np.where(actual_user_sum > 21, LOSE_INDEX, state)
+        state = np.where(actual_user_sum == 21,
+                         np.where(actual_dealer_sum == 21, LOSE_INDEX, WIN_INDEX), state)
+        return state
+
+    def game_over(self):
+        return self.stand | (self.state == WIN_INDEX) | (self.state == LOSE_INDEX)
+
+    # rewards of Game.check_reward: 0 while playing, 1 on WIN, -1 on LOSE
+    def check_reward(self):
+        over = self.game_over()
+        return np.where(over, np.where(self.state == WIN_INDEX, 1, -1), 0)
+
+    # deals one card to the user of every hand in mask
+    def act_hit(self, mask):
+        cards = draw_values(self.rng, int(mask.sum()))
+        self.user_sum[mask] += cards
+        self.user_A[mask] += cards == 1
+        self.state = self.make_state()
+
+    # stands every hand in mask and plays out the dealer: the dealer draws
+    # while below the user's sum and below 17, unless it holds 21
+    def act_stand(self, mask):
+        actual_user_sum, _ = calculate_hands(self.user_sum, self.user_A)
+        actual_dealer_sum, _ = calculate_hands(self.dealer_sum, self.dealer_A)
+        drawing = mask & (actual_dealer_sum != 21)
+        while True:
+            drawing &= (actual_dealer_sum < actual_user_sum) & (actual_dealer_sum < 17)
+            if not drawing.any():
+                break
+            cards = draw_values(self.rng, int(drawing.sum()))
+            self.dealer_sum[drawing] += cards
+            self.dealer_A[drawing] += cards == 1
+            actual_dealer_sum, _ = calculate_hands(self.dealer_sum, self.dealer_A)
+        self.stand |= mask
+        self.state = self.make_state()
+
+    # vectorized Game.simulate_one_step: applies actions[i] to every hand
+    # that is still playing; returns (states, rewards)
+    def simulate_one_step(self, actions):
+        playing = ~self.game_over()
+        hit = playing & (actions == HIT)
+        stand = playing & (actions == STAND)
+        if hit.any():
+            self.act_hit(hit)
+        if stand.any():
+            self.act_stand(stand)
+        return self.state, self.check_reward()
+
+    # vectorized Game.simulate_sequence: plays every hand to the end with
+    # policy (a function of a state index array, e.g. default_policy) and
+    # returns (episode states, episode lengths, final rewards); row i of
+    # the (M, T) states array holds the states of hand i, including the
+    # terminal one, padded with -1
+    def simulate_sequence(self, policy=default_policy):
+        columns = []
+        lengths = np.zeros(self.num_hands, dtype=np.int64)
+        # hands whose terminal state is already recorded
+        finished = np.zeros(self.num_hands, dtype=bool)
+        while True:
+            columns.append(np.where(finished, -1, self.state))
+            lengths += ~finished
+            finished |= self.game_over()
+            if finished.all():
+                break
+            self.simulate_one_step(policy(self.state))
+        return np.stack(columns, axis=1), lengths, self.check_reward()
+
+
+# per-state sums of discounted returns and visit counts of num_episodes MC
+# episodes played with the default policy, as (S, N) arrays over
+# game.states (the same sums Agent.MC_run adds to S_MC and N_MC)
+def mc_statistics(num_episodes, discount, seed=None, rng=None, batch_size=100000):
+    rng = rng if rng is not None else np.random.default_rng(seed)
+    S = np.zeros(NUM_STATES)
+    N = np.zeros(NUM_STATES, dtype=np.int64)
+    done = 0
+    while done < num_episodes:
+        size = min(batch_size, num_episodes - done)
+        game = BatchGame(size, rng=rng)
+        episodes, lengths, rewards = game.simulate_sequence()
+        # only the terminal step has a reward, so G_t = discount^(L-1-t) * r
+        steps_left = lengths[:, None] - 1 - np.arange(episodes.shape[1])
+        valid = episodes >= 0
+        returns = np.power(discount, np.maximum(steps_left, 0)) * rewards[:, None]
+        S += np.bincount(episodes[valid], weights=returns[valid], minlength=NUM_STATES)
+        N += np.bincount(episodes[valid], minlength=NUM_STATES)
+        done += size
+    return S, N
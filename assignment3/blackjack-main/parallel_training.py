@@ -0,0 +1,173 @@
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ai import Agent, DISCOUNT
+from batch_game import mc_statistics
+
+'''
+    Multi-process training of an Agent.
+
+    MC: the episodes are split into one shard per worker. Every worker plays
+    its shard on the vectorized simulator of batch_game.py with its own
+    random stream and returns the per-state sums (S, N). The sums add up
+    exactly, so they go straight into S_MC and N_MC.
+
+    TD and Q-learning: every worker is an actor that starts a round from a
+    copy of the shared table, plays its share of the round's episodes with
+    Game and the usual updates, and sends back its table, visit counts and
+    the number of updates of every entry. At the end of the round, each
+    entry moves to the update-weighted mean of the actors' values:
+        V(s) += sum_k n_k(s) * (V_k(s) - V(s)) / sum_k n_k(s)
+        Q(s, a) += sum_k n_k(s, a) * (Q_k(s, a) - Q(s, a)) / sum_k n_k(s, a)
+    where n_k(s) is the number of visits of actor k to s in this round and
+    n_k(s, a) the number of times it took a in s. An actor that visited s
+    but never took a leaves Q(s, a) unchanged, so it must not dilute the
+    updates of the actors that did. N then grows by the total visits. More rounds mean more frequent merges,
+    which brings the result closer to the sequential run.
+
+    Worker streams are spawned from one np.random.SeedSequence, so a run is
+    reproducible for a given seed and number of workers.
+
+        python parallel_training.py -a 1 -n 1000000 -w 8
+'''
+
+ALG_MC = 1
+ALG_TD = 2
+ALG_QL = 3
+
+DEFAULT_ROUNDS = 100
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+# splits total into parts that differ by at most one
+def split_work(total, parts):
+    return [total // parts + (k < total % parts) for k in range(parts)]
+
+
+# one independent SeedSequence per worker
+def worker_seeds(seed, num_workers):
+    return np.random.SeedSequence(seed).spawn(num_workers)
+
+
+def _mc_worker(num_episodes, seed_seq):
+    return mc_statistics(num_episodes, DISCOUNT, rng=np.random.default_rng(seed_seq))
+
+
+# plays num_episodes TD (algorithm ALG_TD) or Q-learning episodes starting
+# from the given table and visit counts; returns the updated copies and the
+# number of updates of every table entry
+def _actor_worker(algorithm, values, counts, num_episodes, seed):
+    # Game draws its cards from the random module
+    random.seed(seed)
+    agent = Agent()
+    if algorithm == ALG_TD:
+        table, visits = agent.TD_values, agent.N_TD
+    else:
+        table, visits = agent.Q_values, agent.N_Q
+    table.values[:] = values
+    visits.values[:] = counts
+    if algorithm == ALG_TD:
+        agent.TD_train(num_episodes)
+        updates = visits.values - counts
+    else:
+        updates = np.array(agent.Q_train(num_episodes), dtype=np.int64)
+    return table.values, visits.values, updates
+
+
+# merges the (values, counts, updates) of actors that all started from the
+# given table and counts into them, in place. updates has the shape of the
+# table: per state for TD, per (state, action) for Q-learning.
+def merge_actors(values, counts, results):
+    new_visits = np.zeros_like(counts)
+    total_updates = np.zeros(values.shape, dtype=np.int64)
+    weighted = np.zeros_like(values)
+    for actor_values, actor_counts, updates in results:
+        new_visits += actor_counts - counts
+        total_updates += updates
+        weighted += updates * (actor_values - values)
+    updated = total_updates > 0
+    values[updated] += weighted[updated] / total_updates[updated]
+    counts += new_visits
+
+
+# adds num_simulation MC episodes to agent.S_MC and agent.N_MC
+def parallel_MC(agent, num_simulation, workers=None, seed=None):
+    workers = workers or default_workers()
+    shards = split_work(num_simulation, workers)
+    seeds = worker_seeds(seed, workers)
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(_mc_worker, shards, seeds))
+    S = sum(S for S, _ in results)
+    N = sum(N for _, N in results)
+    agent.MC_add_statistics(S, N)
+
+
+# trains agent.TD_values (ALG_TD) or agent.Q_values (ALG_QL) on
+# num_simulation episodes played by parallel actors merged every round
+def parallel_actors(agent, algorithm, num_simulation, workers=None, rounds=DEFAULT_ROUNDS, seed=None):
+    if algorithm not in (ALG_TD, ALG_QL):
+        raise ValueError(f"parallel actors only support TD ({ALG_TD}) and Q-learning ({ALG_QL}), got {algorithm}")
+    workers = workers or default_workers()
+    if algorithm == ALG_TD:
+        table, visits = agent.TD_values, agent.N_TD
+    else:
+        table, visits = agent.Q_values, agent.N_Q
+    rounds = max(1, min(rounds, num_simulation // workers))
+    seeds = worker_seeds(seed, workers)
+    with ProcessPoolExecutor(workers) as pool:
+        for episodes in split_work(num_simulation, rounds):
+            # fresh draws of every worker's stream for this round
+            round_seeds = [int(seq.spawn(1)[0].generate_state(1)[0]) for seq in seeds]
+            shares = split_work(episodes, workers)
+            futures = [pool.submit(_actor_worker, algorithm, table.values, visits.values, n, s)
+                       for n, s in zip(shares, round_seeds) if n > 0]
+            merge_actors(table.values, visits.values, [f.result() for f in futures])
+
+
+def parallel_TD(agent, num_simulation, workers=None, rounds=DEFAULT_ROUNDS, seed=None):
+    parallel_actors(agent, ALG_TD, num_simulation, workers, rounds, seed)
+
+
+def parallel_Q(agent, num_simulation, workers=None, rounds=DEFAULT_ROUNDS, seed=None):
+    parallel_actors(agent, ALG_QL, num_simulation, workers, rounds, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel blackjack training')
+    parser.add_argument('--algorithm', '-a', type=int, default=ALG_MC, help='1: MC, 2: TD, 3: Q-Learning')
+    parser.add_argument('--episodes', '-n', type=int, default=int(1e6), help='number of episodes')
+    parser.add_argument('--workers', '-w', type=int, default=None, help='number of processes (default: all cores)')
+    parser.add_argument('--rounds', '-r', type=int, default=DEFAULT_ROUNDS, help='TD/Q merges per run')
+    parser.add_argument('--seed', '-s', type=int, default=None, help='seed of the worker streams')
+    parser.add_argument('--out', '-o', default=None, help='save the trained agent to this file')
+    parser.add_argument('--compare', '-c', default='test_convergence', help='saved agent to compare with')
+    args = parser.parse_args()
+
+    agent = Agent()
+    start = time.time()
+    if args.algorithm == ALG_MC:
+        parallel_MC(agent, args.episodes, args.workers, args.seed)
+    else:
+        parallel_actors(agent, args.algorithm, args.episodes, args.workers, args.rounds, args.seed)
+    print(f"{args.episodes} episodes on {args.workers or default_workers()} workers in {time.time() - start:.2f}s")
+
+    if args.out:
+        agent.save(args.out)
+    if args.compare:
+        from test import ai_compare
+        base = Agent()
+        base.load(args.compare)
+        max_diffs = {ALG_MC: 5, ALG_TD: 20, ALG_QL: 20}
+        ai_compare(base, agent, args.algorithm, 0.25, max_diffs[args.algorithm])
+
+
+if __name__ == '__main__':
+    main()
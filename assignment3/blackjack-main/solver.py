@@ -0,0 +1,225 @@
+import argparse
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from ai import Agent, DISCOUNT
+from game import Game, cards, get_amt, states, HIT, STAND, WIN_STATE, LOSE_STATE
+from state_tables import NUM_STATES, STATE_INDEX
+
+'''
+    Exact solver for the blackjack MDP of game.py.
+
+    Cards are drawn with replacement from `cards`, so every draw has the
+    value distribution CARD_PROBS (1/13 for ace..9, 4/13 for 10). From the
+    rules of Game.act_hit, act_stand and make_state this builds the model
+        P[a, s, s']   probability of moving from s to s' with action a
+        R[s]          reward of s: 1 in WIN_STATE, -1 in LOSE_STATE, else 0
+    over the states of game.states (terminal rows of P are zero: the episode
+    ends after a terminal state). The dealer's hidden card is independent of
+    everything the user has seen, so it is averaged out: hitting to 21 wins
+    unless the dealer's first two cards make 21, and standing wins with the
+    probability that the dealer, drawing by the H17 rule, busts or stops
+    below the user's sum.
+
+    The values follow the same definitions as the learners in ai.py:
+        V(s)    = R[s] + DISCOUNT * sum_s' P[pi(s), s, s'] V(s')
+        Q(s, a) = R[s] + DISCOUNT * sum_s' P[a, s, s'] max_a' Q(s', a')
+    V of default_policy is solved as a linear system and Q by value
+    iteration. States that can never occur keep 0, like in the learned
+    tables.
+
+        python solver.py --out exact_reference
+
+    The output is a reference to compare with, not generated in the repo.
+    Exact values have no samples behind them, so S_MC, N_MC, N_TD and N_Q
+    are all 0 and the file cannot be loaded to continue MC training (which
+    needs MC_values == S_MC / N_MC).
+'''
+
+WIN_INDEX = STATE_INDEX[WIN_STATE]
+LOSE_INDEX = STATE_INDEX[LOSE_STATE]
+
+CARD_PROBS = {}
+for card in cards:
+    CARD_PROBS[get_amt(card)] = CARD_PROBS.get(get_amt(card), 0) + 1.0 / len(cards)
+
+
+def is_terminal(state):
+    return state == WIN_STATE or state == LOSE_STATE
+
+
+# probability that the dealer's first two cards make 21
+def dealer_21_probability(dealer_first):
+    return sum(p for hidden, p in CARD_PROBS.items()
+               if Game.calculate_hand(dealer_first + hidden, (dealer_first == 1) + (hidden == 1))[0] == 21)
+
+
+# probability that the dealer, holding dealer_sum (aces as 1, has_ace if any
+# ace), ends with a hand that loses to actual_user_sum
+@lru_cache(maxsize=None)
+def _dealer_loses(dealer_sum, has_ace, actual_user_sum):
+    actual_dealer_sum, _ = Game.calculate_hand(dealer_sum, has_ace)
+    if actual_dealer_sum < actual_user_sum and actual_dealer_sum < 17:
+        return sum(p * _dealer_loses(dealer_sum + value, has_ace or value == 1, actual_user_sum)
+                   for value, p in CARD_PROBS.items())
+    return float(actual_dealer_sum > 21 or actual_user_sum > actual_dealer_sum)
+
+
+# probability of WIN_STATE after standing with actual_user_sum (< 21)
+# against dealer_first, averaged over the hidden card
+def stand_win_probability(actual_user_sum, dealer_first):
+    win = 0.0
+    for hidden, p in CARD_PROBS.items():
+        dealer_sum = dealer_first + hidden
+        has_ace = dealer_first == 1 or hidden == 1
+        # a dealer holding 21 does not draw and beats any user sum below 21
+        if Game.calculate_hand(dealer_sum, has_ace)[0] != 21:
+            win += p * _dealer_loses(dealer_sum, has_ace, actual_user_sum)
+    return win
+
+
+# {next state: probability} of hitting in a non-terminal state
+def hit_transitions(state):
+    user_sum, user_A_active, dealer_first = state
+    # an inactive ace never becomes active again, so only an active ace
+    # needs to be carried over
+    transitions = {}
+    for value, p in CARD_PROBS.items():
+        new_sum = user_sum + value
+        actual_user_sum, A_active = Game.calculate_hand(new_sum, user_A_active or value == 1)
+        if actual_user_sum == 21:
+            lose = dealer_21_probability(dealer_first)
+            outcomes = [(WIN_STATE, 1 - lose), (LOSE_STATE, lose)]
+        elif actual_user_sum > 21:
+            outcomes = [(LOSE_STATE, 1.0)]
+        else:
+            outcomes = [((new_sum, A_active, dealer_first), 1.0)]
+        for next_state, q in outcomes:
+            transitions[next_state] = transitions.get(next_state, 0.0) + p * q
+    return transitions
+
+
+# {next state: probability} of standing in a non-terminal state
+def stand_transitions(state):
+    user_sum, user_A_active, dealer_first = state
+    win = stand_win_probability(user_sum + user_A_active * 10, dealer_first)
+    return {WIN_STATE: win, LOSE_STATE: 1 - win}
+
+
+# (P, R) arrays of the model, see above
+def build_model():
+    P = np.zeros((2, NUM_STATES, NUM_STATES))
+    R = np.zeros(NUM_STATES)
+    R[WIN_INDEX] = 1
+    R[LOSE_INDEX] = -1
+    for i, state in enumerate(states):
+        if is_terminal(state):
+            continue
+        for action, transitions in ((HIT, hit_transitions(state)), (STAND, stand_transitions(state))):
+            for next_state, p in transitions.items():
+                P[action, i, STATE_INDEX[next_state]] += p
+    return P, R
+
+
+# distribution over game.states of the state Game.reset deals
+def initial_distribution():
+    d = np.zeros(NUM_STATES)
+    for first, p1 in CARD_PROBS.items():
+        for second, p2 in CARD_PROBS.items():
+            user_sum = first + second
+            actual_user_sum, A_active = Game.calculate_hand(user_sum, first == 1 or second == 1)
+            for dealer_first, p3 in CARD_PROBS.items():
+                p = p1 * p2 * p3
+                if actual_user_sum == 21:
+                    lose = dealer_21_probability(dealer_first)
+                    d[WIN_INDEX] += p * (1 - lose)
+                    d[LOSE_INDEX] += p * lose
+                else:
+                    d[STATE_INDEX[(user_sum, A_active, dealer_first)]] += p
+    return d
+
+
+# mask of the states reachable from the deal under the transition matrix T
+def reachable(T, start):
+    seen = start > 0
+    frontier = seen
+    while frontier.any():
+        reached = T[frontier].sum(axis=0) > 0
+        frontier = reached & ~seen
+        seen |= reached
+    return seen
+
+
+# per-state transition matrix of a policy given as an array of actions
+def policy_matrix(P, policy):
+    return P[policy, np.arange(NUM_STATES)]
+
+
+# V of a policy (array of actions per state): solves (I - DISCOUNT P_pi) V = R
+def evaluate_policy(P, R, policy, discount=DISCOUNT):
+    return np.linalg.solve(np.eye(NUM_STATES) - discount * policy_matrix(P, policy), R)
+
+
+# optimal Q by value iteration; returns (Q, iterations)
+def value_iteration(P, R, discount=DISCOUNT, tol=1e-12, max_iterations=1000):
+    Q = np.zeros((NUM_STATES, 2))
+    for iteration in range(1, max_iterations + 1):
+        new_Q = R[:, None] + discount * (P @ Q.max(axis=1)).T
+        if np.abs(new_Q - Q).max() < tol:
+            return new_Q, iteration
+        Q = new_Q
+    return Q, max_iterations
+
+
+def default_policy_actions():
+    return np.array([Agent.default_policy(s) if not is_terminal(s) else STAND for s in states])
+
+
+# exact V of default_policy and optimal Q, with unreachable states at 0
+def solve(discount=DISCOUNT):
+    P, R = build_model()
+    start = initial_distribution()
+    policy = default_policy_actions()
+    V = evaluate_policy(P, R, policy, discount)
+    V[~reachable(policy_matrix(P, policy), start)] = 0
+    Q, _ = value_iteration(P, R, discount)
+    Q[~reachable(P.max(axis=0), start)] = 0
+    return V, Q
+
+
+# Agent holding the exact values: MC_values and TD_values are V of
+# default_policy, Q_values the optimal Q; the sample sums and counts stay 0
+def exact_agent(discount=DISCOUNT):
+    V, Q = solve(discount)
+    agent = Agent()
+    agent.MC_values.values[:] = V
+    agent.TD_values.values[:] = V
+    agent.Q_values.values[:] = Q
+    return agent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exact blackjack values')
+    parser.add_argument('--out', '-o', default=None, help='save the exact values in Agent.save format')
+    parser.add_argument('--compare', '-c', default='test_convergence', help='saved agent to compare with')
+    args = parser.parse_args()
+
+    start = time.time()
+    agent = exact_agent()
+    print(f"solved in {(time.time() - start) * 1000:.1f}ms")
+
+    if args.out:
+        agent.save(args.out)
+    if args.compare:
+        from test import ai_compare, ALG_MC, ALG_TD, ALG_QL
+        base = Agent()
+        base.load(args.compare)
+        ai_compare(base, agent, ALG_MC, 0.25, 5)
+        ai_compare(base, agent, ALG_TD, 0.25, 20)
+        ai_compare(base, agent, ALG_QL, 0.25, 20)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+import numpy as np
+
+from game import states
+
+'''
+    Dense tables over the 382 states of game.states.
+
+    STATE_INDEX maps every state tuple to its position in game.states. A
+    StateTable keeps one value (or one row, e.g. the [HIT, STAND] Q values)
+    per state in a NumPy array, `table.values`, which can be indexed and
+    updated in bulk with STATE_INDEX positions. The table itself behaves like
+    the dicts the Agent used to keep: table[state] reads and writes a value,
+    and iterating over it yields the states in game.states order.
+
+    The mapping view is meant for occasional access (the GUI, test.py,
+    save/load). Each table[state] hashes the state and reads or writes one
+    NumPy element, so the learning loops of ai.py instead look up the
+    STATE_INDEX position once per step and update list copies of `values`.
+'''
+
+NUM_STATES = len(states)
+STATE_INDEX = {s: i for i, s in enumerate(states)}
+
+
+class StateTable(MutableMapping):
+    def __init__(self, dtype=np.float64, width=None):
+        shape = (NUM_STATES,) if width is None else (NUM_STATES, width)
+        self.values = np.zeros(shape, dtype=dtype)
+
+    def __getitem__(self, state):
+        i = STATE_INDEX[state]
+        if self.values.ndim == 1:
+            return self.values.item(i)
+        return StateRow(self.values, i)
+
+    def __setitem__(self, state, value):
+        self.values[STATE_INDEX[state]] = value
+
+    def __delitem__(self, state):
+        raise TypeError("states cannot be removed from a StateTable")
+
+    def __iter__(self):
+        return iter(states)
+
+    def __len__(self):
+        return NUM_STATES
+
+    def __contains__(self, state):
+        return state in STATE_INDEX
+
+
+class StateRow(object):
+    '''
+        Live view of one row of a two-dimensional StateTable. Reads and
+        writes go straight to the table, and it prints like a list, so
+        Agent.save writes "[q_hit,q_stand]" as before.
+    '''
+    __slots__ = ('values', 'i')
+
+    def __init__(self, values, i):
+        self.values = values
+        self.i = i
+
+    def __getitem__(self, action):
+        return self.values.item(self.i, action)
+
+    def __setitem__(self, action, value):
+        self.values[self.i, action] = value
+
+    def __len__(self):
+        return self.values.shape[1]
+
+    def __iter__(self):
+        return iter(self.values[self.i].tolist())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.values[self.i].tolist())
+
+    __str__ = __repr__